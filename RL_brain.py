@@ -6,16 +6,14 @@ Using Tensorflow to build the neural network.
 View more on my tutorial page: https://morvanzhou.github.io/tutorials/
 
 Using:
-Tensorflow: 1.0
-gym: 0.7.3
+Tensorflow: 2.x (tf.keras, tf.function)
 """
 
 import numpy as np
-import pandas as pd
 import tensorflow as tf
 
 np.random.seed(1)
-tf.set_random_seed(1)
+tf.random.set_seed(1)
 
 
 # Deep Q Network off-policy
@@ -52,76 +50,61 @@ class DeepQNetwork:
 
         # consist of [target_net, evaluate_net]
         self._build_net()
-        t_params = tf.get_collection('target_net_params')
-        e_params = tf.get_collection('eval_net_params')
-        self.replace_target_op = [tf.assign(t, e) for t, e in zip(t_params, e_params)]
-
-        self.sess = tf.Session()
+        self.optimizer = tf.keras.optimizers.RMSprop(self.lr)
+        if hasattr(self.optimizer, 'build'):
+            # 在tf.function外面先建好RMSprop的slot变量，_learn_step的trace里不再建变量
+            self.optimizer.build(self.eval_net.trainable_variables)
 
+        self.writer = None
         if output_graph:
-            # $ tensorboard
-            # tf.train.SummaryWriter soon be deprecated, use following
-            tf.summary.FileWriter("logs//", self.get_default_graph())
-
-        self.sess.run(tf.global_variables_initializer())
+            # $ tensorboard --logdir logs
+            self.writer = tf.summary.create_file_writer("logs/")
         self.cost_his = []
 
+    def _build_layers(self, name):
+        # 和原来一样：两层50个tanh，输出层线性，权重N(0, 0.3)，偏置0.1
+        w_initializer, b_initializer = tf.random_normal_initializer(0., 0.3), tf.constant_initializer(0.1)
+        n_l1 = 50
+        net = tf.keras.Sequential([
+            tf.keras.layers.Dense(n_l1, activation='tanh', kernel_initializer=w_initializer,
+                                  bias_initializer=b_initializer, name='l1'),
+            tf.keras.layers.Dense(n_l1, activation='tanh', kernel_initializer=w_initializer,
+                                  bias_initializer=b_initializer, name='l2'),
+            tf.keras.layers.Dense(self.n_actions, kernel_initializer=w_initializer,
+                                  bias_initializer=b_initializer, name='l3'),
+        ], name=name)
+        net.build((None, self.n_features))
+        return net
+
     def _build_net(self):
         # ------------------ build evaluate_net ------------------
-        self.s = tf.placeholder(tf.float32, [None, self.n_features], name='s')  # input
-        self.q_target = tf.placeholder(tf.float32, [None, self.n_actions], name='Q_target')  # for calculating loss
-        with tf.variable_scope('eval_net'):
-            # c_names(collections_names) are the collections to store variables
-            c_names, n_l1, w_initializer, b_initializer = \
-                ['eval_net_params', tf.GraphKeys.GLOBAL_VARIABLES], 50, \
-                tf.random_normal_initializer(0., 0.3), tf.constant_initializer(0.1)  # config of layers
-
-            # first layer. collections is used later when assign to target net
-            with tf.variable_scope('l1'):
-                w1 = tf.get_variable('w1', [self.n_features, n_l1], initializer=w_initializer, collections=c_names)
-                b1 = tf.get_variable('b1', [1, n_l1], initializer=b_initializer, collections=c_names)
-                l1 = tf.nn.tanh(tf.matmul(self.s, w1) + b1)
-
-            with tf.variable_scope('l2'):
-                w2 = tf.get_variable('w2', [n_l1, n_l1], initializer=w_initializer, collections=c_names)
-                b2 = tf.get_variable('b2', [1, n_l1], initializer=b_initializer, collections=c_names)
-                l2 = tf.nn.tanh(tf.matmul(l1, w2) + b2)
-
-            # second layer. collections is used later when assign to target net
-            with tf.variable_scope('l3'):
-                w3 = tf.get_variable('w3', [n_l1, self.n_actions], initializer=w_initializer, collections=c_names)
-                b3 = tf.get_variable('b3', [1, self.n_actions], initializer=b_initializer, collections=c_names)
-                self.q_eval = tf.matmul(l2, w3) + b3
-
-        with tf.variable_scope('loss'):
-            self.loss = tf.reduce_mean(tf.squared_difference(self.q_target, self.q_eval))
-        with tf.variable_scope('train'):
-            self._train_op = tf.train.RMSPropOptimizer(self.lr).minimize(self.loss)
-
+        self.eval_net = self._build_layers('eval_net')
         # ------------------ build target_net ------------------
-        self.s_ = tf.placeholder(tf.float32, [None, self.n_features], name='s_')  # input
-        with tf.variable_scope('target_net'):
-            # c_names(collections_names) are the collections to store variables
-            c_names = ['target_net_params', tf.GraphKeys.GLOBAL_VARIABLES]
-
-            # first layer. collections is used later when assign to target net
-            with tf.variable_scope('l1'):
-                w1 = tf.get_variable('w1', [self.n_features, n_l1], initializer=w_initializer, collections=c_names)
-                b1 = tf.get_variable('b1', [1, n_l1], initializer=b_initializer, collections=c_names)
-                l1 = tf.nn.tanh(tf.matmul(self.s_, w1) + b1)
-
-            with tf.variable_scope('l2'):
-                w2 = tf.get_variable('w2', [n_l1, n_l1], initializer=w_initializer, collections=c_names)
-                b2 = tf.get_variable('b2', [1, n_l1], initializer=b_initializer, collections=c_names)
-                l2 = tf.nn.tanh(tf.matmul(l1, w2) + b2)
-
-            # second layer. collections is used later when assign to target net
-            with tf.variable_scope('l3'):
-                w3 = tf.get_variable('w3', [n_l1, self.n_actions], initializer=w_initializer, collections=c_names)
-                b3 = tf.get_variable('b3', [1, self.n_actions], initializer=b_initializer, collections=c_names)
-                self.q_next = tf.matmul(l2, w3) + b3
-
-    def store_transition(self, s, a, r, s_):
+        self.target_net = self._build_layers('target_net')
+
+    @tf.function
+    def replace_target_op(self):
+        # 所有参数在一次调用里复制到target_net
+        for t, e in zip(self.target_net.variables, self.eval_net.variables):
+            t.assign(e)
+
+    @tf.function
+    def _learn_step(self, s, a, r, s_):
+        # q_next和q_eval的计算、目标的构造和梯度更新在同一个图里执行
+        q_next = self.target_net(s_)
+        with tf.GradientTape() as tape:
+            q_eval = self.eval_net(s)
+            # change q_target w.r.t q_eval's action
+            q_target = tf.tensor_scatter_nd_update(
+                q_eval, tf.stack([tf.range(tf.shape(a)[0]), a], axis=1),
+                r + self.gamma * tf.reduce_max(q_next, axis=1))
+            loss = tf.reduce_mean(tf.math.squared_difference(tf.stop_gradient(q_target), q_eval))
+        grads = tape.gradient(loss, self.eval_net.trainable_variables)
+        self.optimizer.apply_gradients(zip(grads, self.eval_net.trainable_variables))
+        return loss
+
+    def store_transition(self, s, a, r, s_, done=None):
+        # done只是为了和DqnCon.store_transition的参数一致，这个算法不区分结束状态
         if not hasattr(self, 'memory_counter'):
             self.memory_counter = 0
 
@@ -134,12 +117,12 @@ class DeepQNetwork:
         self.memory_counter += 1
 
     def choose_action(self, observation):
-        # to have batch dimension when feed into tf placeholder
-        observation = observation[np.newaxis, :]
+        # to have batch dimension when feed into the network
+        observation = np.asarray(observation, dtype=np.float32)[np.newaxis, :]
 
         if np.random.uniform() < self.epsilon:
             # forward feed the observation and get q value for every actions
-            actions_value = self.sess.run(self.q_eval, feed_dict={self.s: observation})
+            actions_value = self.eval_net(observation).numpy()
             action = np.argmax(actions_value)
         else:
             action = np.random.randint(0, self.n_actions)
@@ -148,7 +131,7 @@ class DeepQNetwork:
     def learn(self):
         # check to replace target parameters
         if self.learn_step_counter % self.replace_target_iter == 0:
-            self.sess.run(self.replace_target_op)
+            self.replace_target_op()
             print('\ntarget_params_replaced\n')
 
         # sample batch memory from all memory
@@ -156,23 +139,7 @@ class DeepQNetwork:
             sample_index = np.random.choice(self.memory_size, size=self.batch_size)
         else:
             sample_index = np.random.choice(self.memory_counter, size=self.batch_size)
-        batch_memory = self.memory[sample_index, :]
-
-        q_next, q_eval = self.sess.run(
-            [self.q_next, self.q_eval],
-            feed_dict={
-                self.s_: batch_memory[:, -self.n_features:],  # fixed params
-                self.s: batch_memory[:, :self.n_features],  # newest params
-            })
-
-        # change q_target w.r.t q_eval's action
-        q_target = q_eval.copy()
-
-        batch_index = np.arange(self.batch_size, dtype=np.int32)
-        eval_act_index = batch_memory[:, self.n_features].astype(int)
-        reward = batch_memory[:, self.n_features + 1]
-
-        q_target[batch_index, eval_act_index] = reward + self.gamma * np.max(q_next, axis=1)
+        batch_memory = self.memory[sample_index, :].astype(np.float32)
 
         """
         For example in this batch I have 2 samples and 3 actions:
@@ -201,15 +168,23 @@ class DeepQNetwork:
         """
 
         # train eval network
-        _, self.cost = self.sess.run([self._train_op, self.loss],
-                                     feed_dict={self.s: batch_memory[:, :self.n_features],
-                                                self.q_target: q_target})
+        self.cost = float(self._learn_step(batch_memory[:, :self.n_features],
+                                           batch_memory[:, self.n_features].astype(np.int32),
+                                           batch_memory[:, self.n_features + 1],
+                                           batch_memory[:, -self.n_features:]))
         self.cost_his.append(self.cost)
+        if self.writer is not None:
+            with self.writer.as_default():
+                tf.summary.scalar('cost', self.cost, step=self.learn_step_counter)
 
         # increasing epsilon
         self.epsilon = self.epsilon + self.epsilon_increment if self.epsilon < self.epsilon_max else self.epsilon_max
         self.learn_step_counter += 1
 
+    def get_epi(self):
+        # 和DqnCon.get_epi一样返回探索（随机动作）的概率
+        return 1 - self.epsilon
+
     def plot_cost(self):
         import matplotlib.pyplot as plt
         plt.plot(np.arange(len(self.cost_his)), self.cost_his)
@@ -0,0 +1,209 @@
+import argparse
+import multiprocessing
+import queue
+import time
+
+import numpy as np
+
+import npnet
+import rules
+from engine import Game2048Engine
+
+# 几个actor进程玩无界面的游戏，选动作时把状态发给推理进程；推理进程把各actor的请求
+# 凑成一批一起算；learner（主进程）收经验、训练DqnCon，每隔几步把权重发给推理进程。
+# actor和推理进程只用numpy（npnet），不import tensorflow，启动很快。
+
+
+def choose_actions(net, observations, epsilon, rng):
+    # 和DqnCon.choose_actions相同：规则得分的十分之一加Q值，epsilon的概率随机走
+    act = np.array([rules.rule_scores(o.reshape((4, 4))) for o in observations])
+    cal = net.predict(observations.reshape((-1, 4, 4, 1)))
+    actions = np.argmax(act / 10 + cal, axis=1)
+    explore = rng.uniform(size=len(observations)) < epsilon
+    actions[explore] = rng.randint(4, size=explore.sum())
+    return actions
+
+
+def serve(layers, weights, epsilon, requests, responses, updates, max_batch=64, max_wait_ms=2.0, seed=None):
+    """推理进程：从requests取(actor编号, 状态)，攒够max_batch个或者等了max_wait_ms毫秒就一起算，
+    把动作放进responses[actor编号]。updates里有新的(权重, epsilon)时换上最新的，收到None时退出。
+    """
+    net = npnet.NumpyNet(layers, weights)
+    rng = np.random.RandomState(seed)
+    max_wait = max_wait_ms / 1000.0
+    while True:
+        try:
+            while True:
+                weights, epsilon = updates.get_nowait()
+                net.set_weights(weights)
+        except queue.Empty:
+            pass
+        try:
+            request = requests.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if request is None:
+            break
+        batch = [request]
+        deadline = time.time() + max_wait
+        stop = False
+        while len(batch) < max_batch:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                request = requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is None:
+                stop = True
+                break
+            batch.append(request)
+        observations = np.array([obs for _, obs in batch])
+        actions = choose_actions(net, observations, epsilon, rng)
+        for (actor, _), action in zip(batch, actions):
+            responses[actor].put(int(action))
+        if stop:
+            break
+
+
+def act(actor, requests, response, transitions, stop, seed=None, chunk=32):
+    """actor进程：一局接一局地玩，每步向推理进程要动作，经验每chunk条发给learner一次
+
+    发给learner的消息为('transitions', (s, a, r, s_, done))或('episode', (得分, 步数))。
+    """
+    env = Game2048Engine(seed=seed)
+    pending = []
+
+    def flush():
+        if pending:
+            s, a, r, s_, done = zip(*pending)
+            transitions.put(('transitions', (np.array(s, dtype=np.uint8), np.array(a, dtype=np.uint8),
+                                             np.array(r, dtype=np.float32), np.array(s_, dtype=np.uint8),
+                                             np.array(done))))
+            del pending[:]
+
+    while not stop.is_set():
+        observation = env.reset()
+        while not stop.is_set():
+            requests.put((actor, observation))
+            action = None
+            while action is None and not stop.is_set():
+                try:
+                    action = response.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            if action is None:
+                return
+            observation_next, reward, done = env.step(action)
+            if (observation_next == observation).all():
+                reward = -10  # 和high-level.py一样，不能走的动作给-10
+            pending.append((observation, action, reward, observation_next, done))
+            if len(pending) >= chunk:
+                flush()
+            if done:
+                break
+            observation = observation_next
+        flush()
+        if not stop.is_set():
+            transitions.put(('episode', (env.get_score(), env.moves)))
+
+
+class ActorLearner(object):
+    """learner在当前进程，n_actors个actor进程和一个推理进程
+
+    学习算法和high-level.py相同：超过warmup条经验以后每收到learn_every条经验learn一次，
+    每publish_every次learn把权重和探索概率发给推理进程。
+    """
+
+    def __init__(self, n_actors=4, **kw):
+        from my_rlbrain import DqnCon  # 只有learner需要tensorflow
+        self.brain = DqnCon(**kw.get('brain_kw', {}))
+        self.n_actors = n_actors
+        self.warmup = kw.get('warmup', 2000)
+        self.learn_every = kw.get('learn_every', 1)
+        self.publish_every = kw.get('publish_every', 10)
+        self.seed = kw.get('seed')
+        ctx = multiprocessing.get_context('spawn')
+        self.requests = ctx.Queue()
+        self.responses = [ctx.Queue() for _ in range(n_actors)]
+        self.updates = ctx.Queue()
+        self.transitions = ctx.Queue(maxsize=kw.get('queue_size', 256))  # 满了时actor等learner
+        self.stop = ctx.Event()
+        net = npnet.NumpyNet.from_model(self.brain.real)
+        self.server = ctx.Process(target=serve, args=(net.layers, net.weights, self.brain.get_epi(), self.requests,
+                                                      self.responses, self.updates, kw.get('max_batch', 64),
+                                                      kw.get('max_wait_ms', 2.0), self.seed))
+        seeds = np.random.SeedSequence(self.seed).generate_state(n_actors).tolist()
+        self.actors = [ctx.Process(target=act, args=(i, self.requests, self.responses[i], self.transitions,
+                                                     self.stop, seeds[i]))
+                       for i in range(n_actors)]
+        self.episodes = []
+        self.learn_steps = 0
+
+    def publish(self):
+        self.updates.put((self.brain.real.get_weights(), self.brain.get_epi()))
+
+    def run(self, episodes=1000, verbose=True):
+        # 一共玩完episodes局后停止，返回每局的(得分, 步数)
+        for p in [self.server] + self.actors:
+            p.daemon = True
+            p.start()
+        owed = 0.0  # 还欠着的learn次数
+        start = time.time()
+        try:
+            while len(self.episodes) < episodes:
+                kind, data = self.transitions.get()
+                if kind == 'episode':
+                    self.episodes.append(data)
+                    if verbose:
+                        print("第%d局，坚持%d步,得到%d分,探索概率%.2f，每秒%.0f步" % (
+                            len(self.episodes), data[1], data[0], self.brain.get_epi(),
+                            self.brain.memory_counter / (time.time() - start)))
+                    continue
+                self.brain.store_transitions(*data)
+                if self.brain.memory_counter <= self.warmup:
+                    continue
+                owed += len(data[0]) / float(self.learn_every)
+                while owed >= 1:
+                    self.brain.learn()
+                    owed -= 1
+                    self.learn_steps += 1
+                    if self.learn_steps % self.publish_every == 0:
+                        self.publish()
+        finally:
+            self.close()
+        return self.episodes
+
+    def close(self):
+        self.stop.set()
+        # actor可能正在等动作或者等队列有空位，先清空经验队列，推理进程最后再停
+        deadline = time.time() + 5
+        while any(p.is_alive() for p in self.actors) and time.time() < deadline:
+            try:
+                self.transitions.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        self.requests.put(None)
+        for p in [self.server] + self.actors:
+            p.join(timeout=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多个actor进程收集经验、一个推理进程批量选动作、主进程训练DqnCon")
+    parser.add_argument('--actors', type=int, default=max(1, (multiprocessing.cpu_count() or 2) - 2))
+    parser.add_argument('--episodes', type=int, default=1000)
+    parser.add_argument('--max-batch', type=int, default=64)
+    parser.add_argument('--max-wait-ms', type=float, default=2.0)
+    parser.add_argument('--learn-every', type=float, default=1)
+    parser.add_argument('--publish-every', type=int, default=10)
+    parser.add_argument('--memory-size', type=int, default=2000)
+    args = parser.parse_args()
+    runner = ActorLearner(args.actors, max_batch=args.max_batch, max_wait_ms=args.max_wait_ms,
+                          learn_every=args.learn_every, publish_every=args.publish_every,
+                          brain_kw={'memory_size': args.memory_size})
+    runner.run(args.episodes)
+
+
+if __name__ == "__main__":
+    main()
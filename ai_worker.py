@@ -0,0 +1,180 @@
+import copy
+import multiprocessing
+import queue
+import threading
+
+import numpy as np
+
+import bitboard
+import move
+import npnet
+from cache import AgentCache
+from src import direct
+
+
+class RuleAgent(object):
+    """规则式AI：MC或expectimax，输入数值形式的矩阵返回动作0,1,2,3
+
+    agent为'dqn'时用weights指定的npz（DqnCon.export导出）做numpy前向计算选动作。
+
+    可以pickle，能交给另一个进程运行。
+    """
+
+    def __init__(self, **kw):
+        self.agent = kw.get('agent', 'mc')  # 'mc'、'expectimax'或'dqn'
+        self.think_ms = kw.get('think_ms')  # 每步思考的毫秒数，为None时按固定的rollout次数/深度
+        self.workers = kw.get('workers', 0)  # MC的rollout进程数
+        self.iters = kw.get('iters', 1000)
+        self.depth = kw.get('depth', 8 if self.agent == 'mc' else 4)
+        self.cache = AgentCache(kw['cache']) if kw.get('cache') else None  # 跨步共用的局面缓存
+        # MC的rollout用数组同步推进；为False时用bitboard的标量rollout，每步的局面都查cache
+        self.vectorized = kw.get('vectorized', True)
+        self.interrupted = False  # 上一次调用是否被stop()打断
+        self.rng = np.random.RandomState(kw.get('seed'))  # 每步给MenterCarol的种子从这里取
+        if self.agent == 'expectimax':
+            self.expectimax = direct.Expectimax(depth=self.depth)  # 置换表跨步共用
+        if self.agent == 'dqn':
+            self.net = npnet.NumpyAgent(kw['weights'])
+
+    def seed(self, seed):
+        # 每局开始时调用：重设随机数，清掉会影响结果的置换表，同一个seed的一局结果相同
+        # （think_ms模式按时间停止，结果仍然不能复现）；AgentCache只存确定的得分，留着
+        self.rng = np.random.RandomState(seed)
+        if self.agent == 'expectimax':
+            self.expectimax.table.clear()
+
+    def __call__(self, matrix, stop=None):
+        # stop()返回True时尽早结束搜索，interrupted为True，这时返回的动作不是完整搜索的结果
+        mat = matrix.copy()
+        self.interrupted = False
+        if self.agent == 'dqn':
+            return self.net(mat)
+        if self.agent == 'expectimax':
+            if self.think_ms:
+                action = self.expectimax.choose_anytime(mat, self.think_ms, stop=stop)
+            else:
+                action = self.expectimax.choose(mat, stop=stop)
+            self.interrupted = self.expectimax.interrupted
+            return action
+        mc = move.MenterCarol(mat, vectorized=self.vectorized, bitboard=True, workers=self.workers, cache=self.cache,
+                              seed=self.rng.randint(2 ** 31))
+        if self.think_ms:
+            action = mc.choose_anytime(self.think_ms, self.depth, stop=stop)
+        else:
+            action = mc.choose(self.iters, self.depth, stop=stop)
+        self.interrupted = mc.interrupted
+        return action
+
+
+def spawn_outcomes(bb):
+    # 在bb上加一个块的所有可能局面，按概率从大到小排列，返回[(概率, 局面)]
+    cells = bitboard.empty_cells(bb)
+    outcomes = [(tile_prob / len(cells), bb | (tile << (4 * i)))
+                for tile, tile_prob in direct.TILE_PROBS for i in cells]
+    outcomes.sort(key=lambda x: -x[0])
+    return outcomes
+
+
+def _ponder(agent, matrix, action, requests):
+    # 等待下一个请求时，先把走完action后最可能出现的局面都算好，有新请求就停下
+    bb = bitboard.from_matrix(matrix)
+    after, _ = bitboard.move(bb, action)
+    pondered = {}
+    if after == bb:
+        return pondered
+    stop = lambda: not requests.empty()
+    for prob, board in spawn_outcomes(after):
+        if stop():
+            break
+        pondered_action = int(agent(bitboard.to_matrix(board), stop=stop))
+        if agent.interrupted:
+            break  # 被打断的搜索结果不可靠，不存；搜索完整做完时即使有了新请求也存下
+        pondered[board] = pondered_action
+    return pondered
+
+
+def _serve(agent, requests, results, ponder=False):
+    # 后台循环：取(token, 矩阵)，算出动作后放回(token, 动作)，收到None时退出
+    # ponder时先查上一步预先算好的局面，命中时直接返回
+    # agent出错时放回(token, 异常)，由poll抛出，后台循环继续等下一个请求
+    pondered = {}
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        token, matrix = request
+        try:
+            action = pondered.get(bitboard.from_matrix(matrix))
+            if action is None:
+                action = int(agent(matrix))
+        except Exception as e:
+            results.put((token, e))
+            pondered = {}
+            continue
+        results.put((token, action))
+        try:
+            pondered = _ponder(agent, matrix, action, requests) if ponder else {}
+        except Exception:
+            pondered = {}  # 预先搜索出错只是少了命中，不影响下一个请求
+
+
+class AIWorker(object):
+    """在后台线程或进程里运行agent，GUI用submit提交局面、用poll取结果
+
+    每次submit返回一个token，poll只返回最后一次提交的结果，过期的结果直接丢掉。
+    ponder=True时，在等下一个局面的空闲时间里预先搜索加块后可能出现的局面。
+    """
+
+    def __init__(self, agent, mode='thread', ponder=False):
+        self.mode = mode
+        if mode == 'process' and getattr(agent, 'workers', 0) > 1:
+            # 后台进程是守护进程，不能再开rollout的进程池，改成在这个进程里做rollout
+            agent = copy.copy(agent)
+            agent.workers = 0
+        if mode == 'process':
+            self.requests = multiprocessing.Queue()
+            self.results = multiprocessing.Queue()
+            self.worker = multiprocessing.Process(target=_serve, args=(agent, self.requests, self.results, ponder))
+        else:
+            self.requests = queue.Queue()
+            self.results = queue.Queue()
+            self.worker = threading.Thread(target=_serve, args=(agent, self.requests, self.results, ponder))
+        self.worker.daemon = True
+        self.worker.start()
+        self.token = 0
+        self.pending = None  # 还没取到结果的token
+
+    def submit(self, matrix):
+        self.token += 1
+        self.pending = self.token
+        self.requests.put((self.token, matrix.copy()))
+        return self.token
+
+    def busy(self):
+        # 最后一次提交的局面还没有结果
+        return self.pending == self.token
+
+    def alive(self):
+        return self.worker.is_alive()
+
+    def poll(self):
+        # 没有新结果时返回None；agent算这个局面时出错则抛出那个异常
+        while True:
+            try:
+                token, action = self.results.get_nowait()
+            except queue.Empty:
+                return None
+            if token == self.token:
+                self.pending = None
+                if isinstance(action, Exception):
+                    raise action
+                return action
+
+    def cancel(self):
+        # 之后到达的旧结果都会被poll丢掉
+        self.token += 1
+        self.pending = None
+
+    def stop(self):
+        self.requests.put(None)
+        self.worker.join(timeout=1)
@@ -0,0 +1,112 @@
+import numpy as np
+
+import bitboard
+
+# 行打包成16位整数时每格的位移，第c格在第4*c位，和bitboard.py一致
+_SHIFTS = np.array([0, 4, 8, 12], dtype=np.uint32)
+
+
+def _view(boards, action):
+    # 把(N,4,4)的四个方向都转换成向左移动
+    if action == 0:
+        return boards
+    elif action == 1:
+        return boards[:, :, ::-1]
+    elif action == 2:
+        return boards.transpose(0, 2, 1)
+    elif action == 3:
+        return boards[:, ::-1].transpose(0, 2, 1)
+    raise ValueError("unknown action {}".format(action))
+
+
+def move_batch(boards, action):
+    # 所有棋盘向同一方向移动，boards为(N,4,4)的2的对数，返回新棋盘和得分
+    rows = (_view(boards, action).astype(np.uint32) << _SHIFTS).sum(axis=2)
+    new_rows = bitboard.ROW_LEFT[rows]
+    score = bitboard.ROW_SCORE[rows].sum(axis=1).astype(float)
+    new_view = ((new_rows[..., np.newaxis] >> _SHIFTS) & bitboard.CELL_MASK).astype(np.uint8)
+    new_boards = np.empty_like(boards)
+    _view(new_boards, action)[:] = new_view
+    return new_boards, score
+
+
+def move_all(boards):
+    # 四个方向都移动一次，返回(4,N,4,4)的新棋盘、(4,N)的得分和是否能移动
+    results = [move_batch(boards, a) for a in range(4)]
+    new_boards = np.stack([r[0] for r in results])
+    scores = np.stack([r[1] for r in results])
+    legal = (new_boards != boards).any(axis=(2, 3))
+    return new_boards, scores, legal
+
+
+def spawn_batch(boards, rng, mask=None):
+    # 在每个棋盘的随机空格放一个2或4（概率3:1），mask为False的棋盘不处理
+    flat = boards.reshape((len(boards), 16))
+    keys = rng.random_sample(flat.shape)
+    keys[flat != 0] = -1
+    cells = keys.argmax(axis=1)
+    has_room = keys.max(axis=1) >= 0
+    if mask is not None:
+        has_room &= mask
+    values = np.where(rng.random_sample(len(boards)) < 0.25, 2, 1).astype(np.uint8)
+    index = np.nonzero(has_room)[0]
+    flat[index, cells[index]] = values[index]
+    return has_room
+
+
+class BatchEngine(object):
+    """同时进行n局游戏的无界面2048
+
+    boards为(n,4,4)的uint8的2的对数，规则和engine.Game2048Engine一致，
+    结束的游戏自动重新开始。
+    """
+    START_TILES = 2
+
+    def __init__(self, n, **kw):
+        self.n = n
+        self.rng = np.random.RandomState(kw.get('seed'))
+        self.auto_reset = kw.get('auto_reset', True)
+        self.boards = np.zeros((n, 4, 4), dtype=np.uint8)
+        self.scores = np.zeros(n)
+        self.moves = np.zeros(n, dtype=np.int64)
+
+    def reset(self, mask=None):
+        # 重新开始mask中的游戏，默认全部，返回状态
+        if mask is None:
+            mask = np.ones(self.n, dtype=bool)
+        self.boards[mask] = 0
+        self.scores[mask] = 0
+        self.moves[mask] = 0
+        for _ in range(self.START_TILES):
+            spawn_batch(self.boards, self.rng, mask)
+        return self.observation()
+
+    def observation(self):
+        # (n,16)的2的对数，和Game2048Engine.observation一致
+        return self.boards.reshape((self.n, 16)).astype(float)
+
+    def to_matrix(self):
+        return bitboard.VALUES[self.boards]
+
+    def legal_moves(self):
+        return move_all(self.boards)[2].T
+
+    def step(self, actions):
+        # actions为长度n的动作，返回下一个状态、奖励、是否结束和信息
+        # 结束的游戏返回的是结束时的状态，重新开始后的状态用observation()取
+        actions = np.asarray(actions)
+        new_boards, scores, legal = move_all(self.boards)
+        index = np.arange(self.n)
+        acted = legal[actions, index]
+        rewards = np.where(acted, scores[actions, index], 0.0)
+        self.boards[acted] = new_boards[actions, index][acted]
+        self.scores += rewards
+        self.moves += acted
+        spawn_batch(self.boards, self.rng, acted)
+        dones = ~move_all(self.boards)[2].any(axis=0)
+        observation_next = self.observation()
+        info = {'scores': self.scores.copy(), 'moves': self.moves.copy(),
+                'max_tile': self.to_matrix().max(axis=(1, 2))}
+        if self.auto_reset and dones.any():
+            self.reset(dones)
+        return observation_next, rewards, dones, info
@@ -0,0 +1,206 @@
+import argparse
+import json
+import os
+import platform
+import random
+import time
+
+import numpy as np
+
+import batch_env
+import bitboard
+import engine
+import evaluation
+import move
+import move_kernel
+from ai_worker import RuleAgent
+from src import direct
+
+BASELINE = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'benchmark_baseline.json')
+SEED = 2048
+
+
+def _boards(n, seed=SEED):
+    # 固定种子的随机中盘局面：随机走一段步数的游戏局面
+    rng = random.Random(seed)
+    env = engine.Game2048Engine(seed=seed)
+    boards = []
+    while len(boards) < n:
+        env.reset()
+        for _ in range(rng.randrange(20, 200)):
+            if env.no_more_hints():
+                break
+            env.move_tiles(rng.randrange(4))
+        if not env.no_more_hints():
+            boards.append(env.board.copy())
+    return boards
+
+
+def _rate(func, items, min_seconds=0.3, repeat=3):
+    # 反复对items调用func直到超过min_seconds，返回每秒处理的个数；测repeat次取最快的，减少抖动
+    best = 0.0
+    for _ in range(repeat):
+        count = 0
+        start = time.time()
+        while True:
+            for item in items:
+                func(item)
+            count += len(items)
+            elapsed = time.time() - start
+            if elapsed >= min_seconds:
+                break
+        best = max(best, count / elapsed)
+    return best
+
+
+def bench_moves(boards):
+    mats = [engine.to_matrix(b) for b in boards]
+    bbs = [bitboard.from_board(b) for b in boards]
+    actions = (move.LeftAction, move.RightAction, move.UpAction, move.DownAction)
+    stacked = np.stack(boards)
+    return {
+        'move_py_moves_per_sec': 4 * _rate(lambda m: [a(m).handleData() for a in actions], mats[:200]),
+        'kernel_moves_per_sec': 4 * _rate(move_kernel.move_all, mats[:200]),
+        'engine_moves_per_sec': 4 * _rate(lambda b: [engine.move_board(b, a) for a in range(4)], boards[:200]),
+        'bitboard_moves_per_sec': 4 * _rate(lambda bb: [bitboard.move(bb, a) for a in range(4)], bbs),
+        'batch_moves_per_sec': 4 * len(stacked) * _rate(batch_env.move_all, [stacked]),
+    }
+
+
+def bench_spawn(boards):
+    bbs = [bitboard.from_board(b) for b in boards]
+    mats = [engine.to_matrix(b) for b in boards]
+    mc = move.MenterCarol(None)
+    random.seed(SEED)
+    rng = np.random.RandomState(SEED)
+    stacked = np.stack(boards)
+    return {
+        'randomNew_per_sec': _rate(lambda m: mc.randomNew(m.copy()), mats[:200]),
+        'bitboard_spawn_per_sec': _rate(bitboard.spawn, bbs),
+        'batch_spawn_per_sec': len(stacked) * _rate(lambda s: batch_env.spawn_batch(s.copy(), rng), [stacked]),
+    }
+
+
+def bench_evaluate(boards):
+    mats = [engine.to_matrix(b) for b in boards]
+    stacked = np.stack(mats)
+    return {
+        'TestScore_evals_per_sec': _rate(lambda m: move.TestScore(m).evaluate(), mats[:200]),
+        'evaluate_batch_evals_per_sec': len(stacked) * _rate(move.evaluate_batch, [stacked]),
+        'direct_heuristic_evals_per_sec': _rate(direct.heuristic, [bitboard.from_board(b) for b in boards]),
+    }
+
+
+def bench_rollouts(boards, depth=8):
+    bbs = [bitboard.from_board(b) for b in boards[:20]]
+    random.seed(SEED)
+    rng = np.random.RandomState(SEED)
+    return {
+        'bitboard_rollouts_per_sec': 10 * _rate(lambda bb: move.bb_rollouts(bb, 10, depth), bbs),
+        'vectorized_rollouts_per_sec': 500 * _rate(lambda bb: move.vec_rollouts(bb, 500, depth, rng), bbs),
+    }
+
+
+def _latency(agent, mats):
+    times = []
+    for m in mats:
+        start = time.time()
+        agent(m)
+        times.append(1000 * (time.time() - start))
+    return dict(('p%d_ms' % q, float(np.percentile(times, q))) for q in (50, 90, 99))
+
+
+def bench_agents(boards):
+    mats = [engine.to_matrix(b) for b in boards[:20]]
+    agents = {
+        'mc_vectorized_1000x8': RuleAgent(agent='mc'),
+        'mc_anytime_50ms': RuleAgent(agent='mc', think_ms=50),
+        'expectimax_depth4': RuleAgent(agent='expectimax'),
+        'expectimax_anytime_50ms': RuleAgent(agent='expectimax', think_ms=50),
+    }
+    result = {}
+    for name, agent in agents.items():
+        for key, value in _latency(agent, mats).items():
+            result['%s_%s' % (name, key)] = value
+    return result
+
+
+def bench_games(games=4):
+    # 评估流程的吞吐量，用浅的expectimax，只算单进程
+    start = time.time()
+    results, summary = evaluation.run(list(range(games)), {'agent': 'expectimax', 'depth': 2},
+                                      processes=1, checkpoint=None, verbose=False)
+    elapsed = time.time() - start
+    return {'eval_games_per_hour': 3600 * games / elapsed,
+            'eval_moves_per_sec': summary['moves_per_sec']}
+
+
+SUITES = (('moves', bench_moves), ('spawn', bench_spawn), ('evaluate', bench_evaluate),
+          ('rollouts', bench_rollouts), ('agents', bench_agents), ('games', lambda boards: bench_games()))
+
+
+def run(only=None):
+    boards = _boards(500)
+    results = {}
+    for name, suite in SUITES:
+        if only and name not in only:
+            continue
+        start = time.time()
+        results.update(suite(boards))
+        print("%-10s %.1fs" % (name, time.time() - start))
+    return results
+
+
+def machine_info(only=None):
+    # 存基线时一起记下机器和设置，换了机器或设置时和基线的比较没有意义
+    return {'platform': platform.platform(), 'machine': platform.machine(), 'cpu_count': os.cpu_count(),
+            'python': platform.python_version(), 'numpy': np.__version__, 'numba': move_kernel.njit is not None,
+            'seed': SEED, 'suites': only or [name for name, _ in SUITES]}
+
+
+def compare(results, baseline, tolerance=0.2):
+    # 和基线比较，吞吐量低于基线或者延迟高于基线超过tolerance的算退步
+    regressions = []
+    for key in sorted(results):
+        value = results[key]
+        base = baseline.get(key)
+        if not base:
+            print("%-50s %14.1f" % (key, value))
+            continue
+        ratio = value / base
+        lower_is_better = key.endswith('_ms')
+        worse = ratio > 1 + tolerance if lower_is_better else ratio < 1 - tolerance
+        print("%-50s %14.1f  基线%14.1f  x%.2f%s" % (key, value, base, ratio, "  退步" if worse else ""))
+        if worse:
+            regressions.append(key)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="2048的移动、加块、评估、rollout和整局的性能测试")
+    parser.add_argument('--only', nargs='*', choices=[name for name, _ in SUITES])
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help="把这次的结果存为基线")
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+    results = run(args.only)
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    machine = machine_info(args.only)
+    recorded = baseline.get('_machine')
+    if recorded is not None and any(recorded.get(k) != machine[k] for k in ('platform', 'cpu_count', 'numba')):
+        print("基线是在另一台机器或设置下记录的：%s" % json.dumps(recorded, sort_keys=True))
+    regressions = compare(results, baseline, args.tolerance)
+    if args.save_baseline:
+        baseline.update(results)
+        baseline['_machine'] = machine
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+    if regressions:
+        raise SystemExit("退步：" + ", ".join(regressions))
+
+
+if __name__ == "__main__":
+    main()
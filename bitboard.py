@@ -0,0 +1,193 @@
+import random
+import numpy as np
+
+# 64位整数表示的棋盘：16个格子，每格4位存2的对数，第(r, c)格在第4*(4*r+c)位
+# 每一行16位，向左/向右移动的结果和得分在import时预先算好，移动只需查表
+
+ROW_MASK = 0xFFFF
+CELL_MASK = 0xF
+
+
+def move_row(row):
+    # 一行向左滑动并合并，row为2的对数形式的list，返回新行和得分
+    tiles = [e for e in row if e]
+    new_row = []
+    score = 0
+    i = 0
+    while i < len(tiles):
+        if i + 1 < len(tiles) and tiles[i] == tiles[i + 1]:
+            new_row.append(tiles[i] + 1)
+            score += 2 ** (tiles[i] + 1)
+            i += 2
+        else:
+            new_row.append(tiles[i])
+            i += 1
+    new_row += [0] * (len(row) - len(new_row))
+    return new_row, score
+
+
+def _unpack_row(row):
+    return [(row >> (4 * c)) & CELL_MASK for c in range(4)]
+
+
+def _pack_row(cells):
+    row = 0
+    for c in range(4):
+        row |= min(cells[c], CELL_MASK) << (4 * c)  # 超过32768的块无法表示，截断为15
+    return row
+
+
+def _reverse_row(row):
+    return _pack_row(_unpack_row(row)[::-1])
+
+
+def _build_tables():
+    left = np.zeros(65536, dtype=np.uint16)
+    right = np.zeros(65536, dtype=np.uint16)
+    score = np.zeros(65536, dtype=np.uint32)
+    for row in range(65536):
+        new_row, row_score = move_row(_unpack_row(row))
+        left[row] = _pack_row(new_row)
+        score[row] = row_score
+    for row in range(65536):
+        right[row] = _reverse_row(int(left[_reverse_row(row)]))
+    return left, right, score
+
+
+ROW_LEFT, ROW_RIGHT, ROW_SCORE = _build_tables()
+# 标量查表用list比numpy数组快
+_ROW_LEFT = ROW_LEFT.tolist()
+_ROW_RIGHT = ROW_RIGHT.tolist()
+_ROW_SCORE = ROW_SCORE.tolist()
+# 得分只和行的内容有关，向右移动得分按翻转后的行查
+_ROW_SCORE_RIGHT = [_ROW_SCORE[_reverse_row(row)] for row in range(65536)]
+# 每行能否移动：第0位向左、第1位向右；每行的空格：第c位为第c格是否为空
+ROW_MOVES = [int(_ROW_LEFT[row] != row) | int(_ROW_RIGHT[row] != row) << 1 for row in range(65536)]
+ROW_EMPTY = [sum(1 << c for c in range(4) if not (row >> (4 * c)) & CELL_MASK) for row in range(65536)]
+
+
+def transpose(bb):
+    a1 = bb & 0xF0F00F0FF0F00F0F
+    a2 = bb & 0x0000F0F00000F0F0
+    a3 = bb & 0x0F0F00000F0F0000
+    a = a1 | (a2 << 12) | (a3 >> 12)
+    b1 = a & 0xFF00FF0000FF00FF
+    b2 = a & 0x00FF00FF00000000
+    b3 = a & 0x00000000FF00FF00
+    return b1 | (b2 >> 24) | (b3 << 24)
+
+
+def _move_rows(bb, table, scores):
+    new_bb = 0
+    score = 0
+    for r in range(4):
+        row = (bb >> (16 * r)) & ROW_MASK
+        new_bb |= table[row] << (16 * r)
+        score += scores[row]
+    return new_bb, score
+
+
+def move_left(bb):
+    return _move_rows(bb, _ROW_LEFT, _ROW_SCORE)
+
+
+def move_right(bb):
+    return _move_rows(bb, _ROW_RIGHT, _ROW_SCORE_RIGHT)
+
+
+def move_up(bb):
+    new_bb, score = _move_rows(transpose(bb), _ROW_LEFT, _ROW_SCORE)
+    return transpose(new_bb), score
+
+
+def move_down(bb):
+    new_bb, score = _move_rows(transpose(bb), _ROW_RIGHT, _ROW_SCORE_RIGHT)
+    return transpose(new_bb), score
+
+
+MOVES = (move_left, move_right, move_up, move_down)
+
+
+def move(bb, action):
+    # action 0,1,2,3 left,right,up,down，返回新棋盘和得分
+    return MOVES[action](bb)
+
+
+def empty_mask(bb):
+    # 16位的空格掩码，第i位为第i格是否为空
+    return (ROW_EMPTY[bb & ROW_MASK] | ROW_EMPTY[(bb >> 16) & ROW_MASK] << 4 |
+            ROW_EMPTY[(bb >> 32) & ROW_MASK] << 8 | ROW_EMPTY[bb >> 48] << 12)
+
+
+def legal_mask(bb):
+    # 4位的能移动的方向，第a位为动作a能否移动
+    t = transpose(bb)
+    rows = (ROW_MOVES[bb & ROW_MASK] | ROW_MOVES[(bb >> 16) & ROW_MASK] |
+            ROW_MOVES[(bb >> 32) & ROW_MASK] | ROW_MOVES[bb >> 48])
+    columns = (ROW_MOVES[t & ROW_MASK] | ROW_MOVES[(t >> 16) & ROW_MASK] |
+               ROW_MOVES[(t >> 32) & ROW_MASK] | ROW_MOVES[t >> 48])
+    return rows | columns << 2
+
+
+def _build_mask_bits():
+    bits = [()]
+    for mask in range(1, 1 << 16):
+        bits.append(((mask & -mask).bit_length() - 1,) + bits[mask & (mask - 1)])
+    return bits
+
+
+# 掩码 -> 为1的位的序号，从低位到高位
+MASK_BITS = _build_mask_bits()
+
+
+def empty_cells(bb):
+    # 按行优先顺序返回空格的序号，和MenterCarol.randomNew的扫描顺序一致
+    return MASK_BITS[empty_mask(bb)]
+
+
+def spawn(bb, rng=random):
+    # 随机在空格放一个2或4，返回新棋盘和是否已满
+    _value = rng.choice([1, 2, 1, 1])
+    cells = empty_cells(bb)
+    if not cells:
+        return bb, 1
+    i = rng.choice(cells)
+    return bb | (_value << (4 * i)), 0
+
+
+def from_board(board):
+    # uint8的2的对数矩阵转成64位整数
+    bb = 0
+    for i, e in enumerate(np.asarray(board).ravel().tolist()):
+        bb |= int(e) << (4 * i)
+    return bb
+
+
+def to_board(bb):
+    return np.array([(bb >> (4 * i)) & CELL_MASK for i in range(16)],
+                    dtype=np.uint8).reshape((4, 4))
+
+
+_SHIFTS = np.arange(0, 64, 4, dtype=np.uint64)
+
+
+def to_boards(bbs):
+    # N个bitboard转成(N,4,4)的uint8的2的对数
+    bbs = np.asarray(bbs, dtype=np.uint64).reshape((-1, 1))
+    return ((bbs >> _SHIFTS) & np.uint64(CELL_MASK)).astype(np.uint8).reshape((-1, 4, 4))
+
+
+VALUES = np.array([0] + [2.0 ** e for e in range(1, 16)])
+
+
+def from_matrix(matrix):
+    # 数值形式（move.py使用的形式）转成64位整数
+    bb = 0
+    for i, v in enumerate(np.asarray(matrix).ravel().tolist()):
+        if v:
+            bb |= int(v).bit_length() - 1 << (4 * i)
+    return bb
+
+
+def to_matrix(bb):
+    return VALUES[to_board(bb)]
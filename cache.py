@@ -0,0 +1,108 @@
+from collections import OrderedDict
+
+import symmetry
+
+# 估计每个条目占用的字节数：OrderedDict的节点、64位整数的键和一个小的值
+ENTRY_BYTES = 200
+
+
+class LRUCache(object):
+    """以棋盘为键的有界缓存，超出大小时淘汰最久没用过的条目
+
+    max_entries限制条目数，max_bytes按ENTRY_BYTES估算换成条目数，两者取小。
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None, entry_bytes=ENTRY_BYTES):
+        limits = [n for n in (max_entries, max_bytes and max_bytes // entry_bytes) if n]
+        self.max_entries = max(1, min(limits)) if limits else None
+        self.entry_bytes = entry_bytes
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def get(self, key, default=None):
+        try:
+            value = self.data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        if self.max_entries is not None and len(self.data) > self.max_entries:
+            self.data.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.data.clear()
+        self.hits = self.misses = self.evictions = 0
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / float(total) if total else 0.0
+
+    def stats(self):
+        return {'entries': len(self.data), 'bytes': len(self.data) * self.entry_bytes,
+                'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'hit_rate': self.hit_rate()}
+
+
+class SymmetricCache(LRUCache):
+    """对称的局面共用一个条目的LRUCache
+
+    键为bitboard，存取时先换成代表局面。actions=True时值是按动作排列的长度4的数组，
+    存取时按变换换动作顺序；否则值必须在旋转/翻转下不变（例如局面的期望得分）。
+    只有评估函数本身对称时才能用，TestScore偏向左下角，不能用这个缓存。
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None, actions=False, **kw):
+        super(SymmetricCache, self).__init__(max_entries, max_bytes, **kw)
+        self.actions = actions
+
+    def get(self, key, default=None):
+        c, t = symmetry.canonical(key)
+        value = super(SymmetricCache, self).get(c, None)
+        if value is None:
+            return default
+        return symmetry.from_canonical_actions(value, t) if self.actions else value
+
+    def put(self, key, value):
+        c, t = symmetry.canonical(key)
+        if self.actions:
+            value = symmetry.to_canonical_actions(value, t)
+        super(SymmetricCache, self).put(c, value)
+
+    def __contains__(self, key):
+        return symmetry.canonical(key)[0] in self.data
+
+
+class AgentCache(object):
+    """一个agent用的缓存：evals存局面的启发式得分，moves存贪心一步的结果
+
+    键都是bitboard.py的64位整数棋盘，大小限制在两者之间平分。TestScore不对称，
+    所以这里不用SymmetricCache。
+    """
+
+    def __init__(self, max_entries=1000000, max_bytes=None):
+        half_entries = max_entries and max_entries // 2
+        half_bytes = max_bytes and max_bytes // 2
+        self.evals = LRUCache(half_entries, half_bytes)
+        self.moves = LRUCache(half_entries, half_bytes)
+
+    def clear(self):
+        self.evals.clear()
+        self.moves.clear()
+
+    def stats(self):
+        return {'evals': self.evals.stats(), 'moves': self.moves.stats()}
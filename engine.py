@@ -0,0 +1,198 @@
+import random
+import numpy as np
+
+import bitboard
+import profiling
+from bitboard import move_row
+
+# action 0,1,2,3 left,right,up,down，与move.py和game.py的编号一致
+ACTIONS = ('left', 'right', 'up', 'down')
+
+
+def action_view(board, action):
+    # 把四个方向都转换成向左移动，和move.py中的四个Action类一样翻转和转置
+    if action == 0:
+        return board
+    elif action == 1:
+        return board[:, ::-1]
+    elif action == 2:
+        return board.T
+    elif action == 3:
+        return board[::-1].T
+    raise ValueError("unknown action {}".format(action))
+
+
+def move_board(board, action):
+    # 返回移动后的新矩阵和得分，不修改输入
+    new_board = board.copy()
+    view = action_view(new_board, action)
+    score = 0
+    for i in range(view.shape[0]):
+        view[i], row_score = move_row(view[i].tolist())
+        score += row_score
+    return new_board, score
+
+
+def to_matrix(board):
+    # 2的对数转成数值形式，空格为0，和game.step中的mat2048一致
+    mat = np.zeros(board.shape)
+    mat[board > 0] = 2.0 ** board[board > 0]
+    return mat
+
+
+def from_matrix(matrix):
+    # 数值形式转成2的对数形式
+    mat = np.asarray(matrix, dtype=float).reshape((4, 4))
+    board = np.zeros((4, 4), dtype=np.uint8)
+    board[mat > 0] = np.log2(mat[mat > 0]).round().astype(np.uint8)
+    return board
+
+
+# 4位的能移动的方向掩码 -> 能走的动作
+_LEGAL_ACTIONS = [tuple(a for a in range(4) if mask >> a & 1) for mask in range(16)]
+_NIBBLE_LOW = 0x1111111111111111
+
+
+class Game2048Engine(object):
+    """不依赖Tk的2048游戏，用于训练和测试
+
+    棋盘是uint8的2的对数矩阵，规则和Game2048Grid的move_tiles_*、pop_tile、
+    no_more_hints一致。同时维护棋盘的bitboard、空格掩码和每行每列能否移动，
+    加块时只更新所在的行和列，能否移动、是否结束和随机选空格都不用扫描棋盘。
+    直接修改board后要调用sync()。
+    """
+    ROWS = COLUMNS = 4
+    START_TILES = 2
+
+    def __init__(self, **kw):
+        self.random = random.Random(kw.get('seed'))
+        self.board = np.zeros((self.ROWS, self.COLUMNS), dtype=np.uint8)
+        self.score = 0
+        self.moves = 0
+        self.sync()
+
+    def sync(self):
+        # 按board重新计算bitboard（bb和转置后的tbb）、空格掩码和每行每列能否移动
+        # 超过32768的块按32768算，只影响这种块之间能否合并的判断
+        self._set_bitboard(bitboard.from_board(np.minimum(self.board, bitboard.CELL_MASK)))
+
+    def _set_bitboard(self, bb):
+        self.bb = bb
+        self.tbb = bitboard.transpose(bb)
+        self.empty = bitboard.empty_mask(self.bb)
+        self.row_moves = [bitboard.ROW_MOVES[(self.bb >> (16 * r)) & bitboard.ROW_MASK] for r in range(4)]
+        self.column_moves = [bitboard.ROW_MOVES[(self.tbb >> (16 * c)) & bitboard.ROW_MASK] for c in range(4)]
+
+    def _set_cell(self, row, column, value):
+        # 在空格(row, column)放2的对数为value的块，只更新这一行和这一列
+        self.board[row, column] = value
+        value = min(value, bitboard.CELL_MASK)
+        self.bb |= value << (4 * (4 * row + column))
+        self.tbb |= value << (4 * (4 * column + row))
+        self.empty &= ~(1 << (4 * row + column))
+        self.row_moves[row] = bitboard.ROW_MOVES[(self.bb >> (16 * row)) & bitboard.ROW_MASK]
+        self.column_moves[column] = bitboard.ROW_MOVES[(self.tbb >> (16 * column)) & bitboard.ROW_MASK]
+
+    def legal_mask(self):
+        # 4位的能移动的方向，第a位为动作a能否移动
+        rm, cm = self.row_moves, self.column_moves
+        return (rm[0] | rm[1] | rm[2] | rm[3]) | (cm[0] | cm[1] | cm[2] | cm[3]) << 2
+
+    def legal_moves(self):
+        return _LEGAL_ACTIONS[self.legal_mask()]
+
+    def is_game_over(self):
+        return not self.legal_mask()
+
+    def reset(self, seed=None):
+        # 新开一局，返回初始状态
+        if seed is not None:
+            self.random.seed(seed)
+        self.board[:] = 0
+        self.score = 0
+        self.moves = 0
+        self.sync()
+        for n in range(self.START_TILES):
+            self.pop_tile()
+        return self.observation()
+
+    def observation(self):
+        # 16维的2的对数向量，和DqnCon的输入一致
+        return self.board.flatten().astype(float)
+
+    def to_matrix(self):
+        return to_matrix(self.board)
+
+    def set_matrix(self, matrix):
+        self.board = from_matrix(matrix)
+        self.sync()
+
+    def get_score(self):
+        return self.score
+
+    def max_tile(self):
+        return 2 ** int(self.board.max()) if self.board.any() else 0
+
+    def is_full(self):
+        return not self.empty
+
+    def get_available_box(self):
+        # 看那个地方还有空的，按行优先顺序随机选一个
+        cells = bitboard.MASK_BITS[self.empty]
+        if not cells:
+            return None
+        i = cells[self.random.randrange(len(cells))]
+        return i // self.COLUMNS, i % self.COLUMNS
+
+    def pop_tile(self):
+        box = self.get_available_box()
+        if box is not None:
+            _value = self.random.choice([1, 2, 1, 1])  # 即2,4,2,2
+            self._set_cell(box[0], box[1], _value)
+        return box
+
+    def move_tiles(self, action):
+        # 移动，返回是否移动了以及得分，移动了才加入新块
+        if profiling.enabled:
+            t0 = profiling.clock()
+        acted = bool(self.legal_mask() >> action & 1)
+        score = 0
+        if acted:
+            if self.bb & (self.bb >> 1) & (self.bb >> 2) & (self.bb >> 3) & _NIBBLE_LOW:
+                # 有32768的块时bitboard表示不了合并后的块，按矩阵移动
+                self.board, score = move_board(self.board, action)
+                self.sync()
+            else:
+                bb, score = bitboard.move(self.bb, action)
+                self.board = bitboard.to_board(bb)
+                self._set_bitboard(bb)
+        if profiling.enabled:
+            t1 = profiling.clock()
+            profiling.add('engine.move', t1 - t0)
+        if acted:
+            self.score += score
+            self.moves += 1
+            self.pop_tile()
+            if profiling.enabled:
+                profiling.add('engine.spawn', profiling.clock() - t1)
+        return acted, score
+
+    def move_tiles_left(self):
+        return self.move_tiles(0)
+
+    def move_tiles_right(self):
+        return self.move_tiles(1)
+
+    def move_tiles_up(self):
+        return self.move_tiles(2)
+
+    def move_tiles_down(self):
+        return self.move_tiles(3)
+
+    def no_more_hints(self):
+        return self.is_game_over()
+
+    def step(self, action):
+        # 返回下一个状态、奖励和是否结束
+        acted, reward = self.move_tiles(action)
+        return self.observation(), reward, self.no_more_hints()
@@ -0,0 +1,180 @@
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from ai_worker import RuleAgent
+from engine import Game2048Engine
+
+_agent = None
+
+
+def _init_worker(agent_kw):
+    # 每个进程建一个agent，置换表和缓存在这个进程的所有局之间共用
+    global _agent
+    _agent = RuleAgent(**agent_kw)
+
+
+def play_game(agent, seed, max_moves=None):
+    # 用无界面引擎玩一局，返回这一局的结果；agent也按seed重设随机数，同一个seed结果相同
+    if hasattr(agent, 'seed'):
+        agent.seed(seed)
+    env = Game2048Engine(seed=seed)
+    env.reset()
+    start = time.time()
+    while not env.is_game_over():
+        if max_moves is not None and env.moves >= max_moves:
+            break
+        acted, _ = env.move_tiles(int(agent(env.to_matrix())))
+        if not acted:
+            # agent选了不能走的动作时走第一个能走的，避免死循环
+            env.move_tiles(env.legal_moves()[0])
+    seconds = time.time() - start
+    max_tile = env.max_tile()
+    return {'seed': seed, 'score': env.get_score(), 'max_tile': max_tile, 'moves': env.moves,
+            'seconds': seconds, 'win': int(max_tile >= 2048), 'high': int(max_tile >= 1024)}
+
+
+def _play(seed, max_moves):
+    return play_game(_agent, seed, max_moves)
+
+
+def run_config(agent_kw=None, max_moves=None):
+    # 每局结果里记下的设置，经过一次json转换，和从文件读出来的可以直接比较
+    return json.loads(json.dumps({'agent_kw': agent_kw or {}, 'max_moves': max_moves}, sort_keys=True))
+
+
+def checkpoint_name(agent_kw=None, max_moves=None, prefix='eval'):
+    # 按设置生成默认的checkpoint文件名，不同设置的评估不会写进同一个文件
+    config = json.dumps(run_config(agent_kw, max_moves), sort_keys=True)
+    return '%s_%s_%s.jsonl' % (prefix, (agent_kw or {}).get('agent', 'mc'),
+                               hashlib.md5(config.encode('utf-8')).hexdigest()[:8])
+
+
+def load_checkpoint(path, config=None):
+    # 读已经完成的局，文件每行一个json；给了config时只要设置相同的局
+    results = []
+    if path and os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    try:
+                        result = json.loads(line)
+                    except ValueError:
+                        continue  # 写到一半中断的最后一行
+                    if config is None or result.get('config') == config:
+                        results.append(result)
+    return results
+
+
+def summarize(results):
+    if not results:
+        return {'games': 0}
+    scores = np.array([r['score'] for r in results], dtype=float)
+    moves = sum(r['moves'] for r in results)
+    seconds = sum(r['seconds'] for r in results)
+    summary = {'win_rate': np.mean([r['win'] for r in results]),
+               'reach_1024': np.mean([r['max_tile'] >= 1024 for r in results]),
+               'reach_2048': np.mean([r['max_tile'] >= 2048 for r in results]),
+               'mean_score': scores.mean(),
+               'moves_per_sec': moves / seconds if seconds else 0.0}
+    for q in (10, 25, 50, 75, 90):
+        summary['score_p%d' % q] = np.percentile(scores, q)
+    summary = dict((k, float(v)) for k, v in summary.items())
+    summary['games'] = len(results)
+    return summary
+
+
+def run(seeds, agent_kw=None, processes=1, checkpoint=None, max_moves=None, verbose=True):
+    """在进程池里用无界面引擎玩seeds中的每一局
+
+    每局结束就往checkpoint追加一行（带上agent_kw和max_moves），重新运行时跳过checkpoint中
+    设置相同、已经玩过的seed，设置不同的行不算。返回所有局的结果和汇总。
+    """
+    agent_kw = agent_kw or {}
+    config = run_config(agent_kw, max_moves)
+    results = load_checkpoint(checkpoint, config)
+    done = set(r['seed'] for r in results)
+    todo = [s for s in seeds if s not in done]
+    out = open(checkpoint, 'a') if checkpoint else None
+    if out is not None and out.tell():
+        with open(checkpoint, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                out.write('\n')  # 上次中断时最后一行没写完，从新的一行开始
+    try:
+        def record(result):
+            result['config'] = config
+            results.append(result)
+            if out is not None:
+                out.write(json.dumps(result) + '\n')
+                out.flush()
+            if verbose:
+                print("第%d局(seed %d)，得分%d，最大块%d，%d步" % (
+                    len(results), result['seed'], result['score'], result['max_tile'], result['moves']))
+
+        if processes > 1:
+            with ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(agent_kw,)) as pool:
+                futures = [pool.submit(_play, seed, max_moves) for seed in todo]
+                for future in as_completed(futures):
+                    record(future.result())
+        else:
+            _init_worker(agent_kw)
+            for seed in todo:
+                record(_play(seed, max_moves))
+    finally:
+        if out is not None:
+            out.close()
+    wanted = set(seeds)
+    results = [r for r in results if r['seed'] in wanted]
+    return results, summarize(results)
+
+
+def save_pickle(results, path):
+    # 和原来testWin的mc_result.pkl格式一样：(scores, win, highs)
+    with open(path, 'wb') as out:
+        pickle.dump(([r['score'] for r in results], [r['win'] for r in results],
+                     [r['high'] for r in results]), out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量评估2048的AI")
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--seed-start', type=int, default=0)
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--checkpoint', default=None, help="默认按agent的设置生成文件名")
+    parser.add_argument('--pickle', default=None, help="另外保存成testWin的pkl格式")
+    parser.add_argument('--agent', default='mc', choices=('mc', 'expectimax', 'dqn'))
+    parser.add_argument('--weights', default=None, help="dqn用的npz，DqnCon.export或npnet.export_h5导出")
+    parser.add_argument('--think-ms', type=float, default=None)
+    parser.add_argument('--iters', type=int, default=1000)
+    parser.add_argument('--depth', type=int, default=None)
+    parser.add_argument('--cache', type=int, default=None, help="AgentCache的条目数，每个进程一个")
+    parser.add_argument('--scalar', action='store_true', help="MC用bitboard的标量rollout（会用到cache）")
+    parser.add_argument('--max-moves', type=int, default=None)
+    args = parser.parse_args()
+    agent_kw = {'agent': args.agent, 'think_ms': args.think_ms, 'iters': args.iters}
+    if args.depth is not None:
+        agent_kw['depth'] = args.depth
+    if args.weights:
+        agent_kw['weights'] = args.weights
+    if args.cache:
+        agent_kw['cache'] = args.cache
+    if args.scalar:
+        agent_kw['vectorized'] = False
+    seeds = list(range(args.seed_start, args.seed_start + args.games))
+    checkpoint = args.checkpoint or checkpoint_name(agent_kw, args.max_moves)
+    results, summary = run(seeds, agent_kw, args.processes, checkpoint, args.max_moves)
+    if args.pickle:
+        save_pickle(results, args.pickle)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -43,7 +43,9 @@ except:
 
 from src import game2048_score as GS
 from src import game2048_grid as GG
-import move
+from engine import Game2048Engine
+from ai_worker import AIWorker, RuleAgent
+import evaluation
 
 
 class GabrieleCirulli2048(tk.Tk):
@@ -55,6 +57,13 @@ class GabrieleCirulli2048(tk.Tk):
 
         self.train = kw.get("train", 1)  # 从类读取是否训练
         self.ai_time = kw.get('ai_time', 2)
+        self.ai_kw = kw
+        self.ai = RuleAgent(**kw)  # agent、think_ms、workers、cache等参数见RuleAgent
+        self.ai_mode = kw.get('ai_mode', 'thread')  # 界面AI在后台'thread'或'process'中运行
+        self.ai_ponder = kw.get('ponder', False)  # 等待显示时预先搜索可能的下一个局面
+        self.ai_worker = None
+        self.ai_generation = 0  # 每开一局AI游戏加一，旧的poll_ai回调看到编号不同就停下
+        self.engine = Game2048Engine(seed=kw.get('seed'))  # 无界面的游戏引擎
         self.initialize(**kw)  # 画图的初始化
 
     def run(self, **kw):
@@ -111,6 +120,9 @@ class GabrieleCirulli2048(tk.Tk):
     # 建立新游戏
     def new_game(self, *args, **kw):
         self.unbind_all("<Key>")
+        self.ai_generation += 1
+        if self.ai_worker is not None:
+            self.ai_worker.cancel()
         self.score.reset_score()
         self.grid.reset_grid()
         for n in range(self.START_TILES):
@@ -122,6 +134,8 @@ class GabrieleCirulli2048(tk.Tk):
     # 退出功能
     def quit_app(self, **kw):
         if messagebox.askokcancel("Question", "Quit game?"):
+            if self.ai_worker is not None:
+                self.ai_worker.stop()
             self.quit()
             self.destroy()
 
@@ -160,85 +174,72 @@ class GabrieleCirulli2048(tk.Tk):
     # 界面新开一个ai游戏
     def ai_new_game(self, *args, **kw):
         self.unbind_all("<Key>")
+        self.ai_generation += 1
+        if self.ai_worker is not None:
+            self.ai_worker.cancel()  # 上一局还在算的结果不要了
         self.score.reset_score()
-        self.grid.reset_grid()
-        for n in range(self.START_TILES):
-            self.after(
-                10 * random.randrange(3, 7), self.grid.pop_tile
-            )
-        self.after(self.ai_time, self.step)  # 多长时间后调用下一次
+        self.engine.reset()
+        self.grid.show_matrix(self.engine.to_matrix())
+        if self.ai_worker is None:
+            self.ai_worker = AIWorker(self.ai, self.ai_mode, self.ai_ponder)
+        # 搜索在后台进行，界面只定时取结果，不会卡住
+        self.ai_worker.submit(self.engine.to_matrix())
+        self.after(self.ai_time, self.poll_ai, self.ai_generation)  # 多长时间后调用下一次
         self.bind_all("<Key>", self.on_keypressed)
 
+    def poll_ai(self, generation):
+        # 取后台算好的动作，走完后马上提交下一个局面，在显示的同时开始下一次搜索
+        if generation != self.ai_generation:
+            return  # 已经开了新的一局
+        try:
+            pressed = self.ai_worker.poll()
+        except Exception as e:
+            print("AI出错，走第一个能走的动作：%r" % (e,))
+            pressed = self.engine.legal_moves()[0]
+        if pressed is None:
+            if not self.ai_worker.alive():
+                print("AI的后台线程/进程已经退出")
+            elif self.ai_worker.busy():
+                self.after(max(self.ai_time, 10), self.poll_ai, generation)
+            return
+        self.engine.move_tiles(pressed)
+        mat2048 = self.engine.to_matrix()
+        self.grid.show_matrix(mat2048)
+        self.update_score(self.engine.get_score(), mode="set")
+        if self.engine.no_more_hints():
+            self.grid.game_over()
+        else:
+            self.ai_worker.submit(mat2048)
+            self.after(self.ai_time, self.poll_ai, generation)
+
     # 规则式选择动作
     def ai_rule(self, mate):
-        mat = mate.copy()  # 对数形式
-        mc = move.MenterCarol(mat)
-        return mc.choose(1000, 8)
+        return self.ai(mate)
 
     def step(self):
         # 可以返回状态、动作和奖励
-        mat2048 = np.zeros((4, 4))
-        tiles = self.grid.tiles
-        for t in tiles:
-            mat2048[tiles[t].row, tiles[t].column] = tiles[t].value
-        # 2048表格的2对数
+        # 游戏由无界面的engine进行，界面只在非训练时同步显示
+        mat2048 = self.engine.to_matrix()
         pressed = self.ai_rule(mat2048)
-        if pressed == 0:
-            self.grid.move_tiles_left()
-        elif pressed == 1:
-            self.grid.move_tiles_right()
-        elif pressed == 2:
-            self.grid.move_tiles_up()
-        elif pressed == 3:
-            self.grid.move_tiles_down()
-        else:
-            pass
-        mat2048 = np.zeros((4, 4))
-        tiles = self.grid.tiles
-        for t in tiles:
-            mat2048[tiles[t].row, tiles[t].column] = tiles[t].value
-        # 2048表格的2对数
-        done = self.grid.no_more_hints()
+        self.engine.move_tiles(pressed)
+        mat2048 = self.engine.to_matrix()
+        done = self.engine.no_more_hints()
         if self.train:
             return mat2048, done
         else:
+            self.grid.show_matrix(mat2048)
+            self.update_score(self.engine.get_score(), mode="set")
             if done:
-                pass
+                self.grid.game_over()
             else:
                 self.after(self.ai_time, self.step)
 
-    def testWin(self):
-        iters = 100
-        self.train = 1
-        win = []
-        highs = []
-        scores = []
-        for i in range(iters):
-            self.score.reset_score()
-            self.grid.reset_grid()
-            for n in range(self.START_TILES):
-                self.grid.pop_tile()
-            while True:
-                mat, done = self.step()
-                if done:
-                    break
-            if 2048 in mat:
-                isWin = 1
-                high = 1
-            elif 1024 in mat:
-                isWin = 0
-                high = 1
-            else:
-                isWin = 0
-                high = 0
-            score = self.score.get_score()
-            win.append(isWin)
-            scores.append(score)
-            highs.append(high)
-            print("第%d轮，得分%d，胜利与否%d,到达较高水平%d" % (i + 1, score, isWin, high))
-        print("平均胜率为%.2f,平均分数为%.2f" % (sum(win) / float(iters), sum(scores) / float(iters)))
-        with open('mc_result.pkl', 'wb') as out:
-            pickle.dump((scores, win, highs), out)
+    def testWin(self, iters=100, processes=1):
+        # 用无界面引擎批量评估，每局结束就写入mc_result_*.jsonl（文件名按ai的设置区分），中断后重跑会接着跑
+        checkpoint = evaluation.checkpoint_name(self.ai_kw, prefix='mc_result')
+        results, summary = evaluation.run(list(range(iters)), self.ai_kw, processes, checkpoint)
+        print("平均胜率为%.2f,平均分数为%.2f" % (summary['win_rate'], summary['mean_score']))
+        evaluation.save_pickle(results, 'mc_result.pkl')
 
         # 读数据
         # with open('mc_result.pkl', 'rb') as read:
@@ -1,4 +1,4 @@
-from game import GabrieleCirulli2048
+from engine import Game2048Engine
 from RL_brain import DeepQNetwork
 from my_rlbrain import DqnCon
 import numpy as np
@@ -14,7 +14,7 @@ import matplotlib.pyplot as plt
 #                   e_greedy_increment=0.0008, batch_size=1000)
 
 RL = DqnCon()
-env = GabrieleCirulli2048(train=1, rule=0)
+env = Game2048Engine()  # 无界面引擎，不需要Tk
 totle = 0
 plt.figure()
 plt.ion()  # interactive mode on
@@ -1,7 +1,16 @@
 import itertools
 import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import numpy as np
 
+import batch_env
+import bitboard
+import move_kernel
+import profiling
+from rules import evaluate_parts, rule_scores
+
 
 class UpdateNew(object):
     """docstring for UpdateNew"""
@@ -177,58 +186,307 @@ class TestScore(UpdateNew):
         return self.EmptyTest() + 1.2*self.Monotonicity() + self.ALLnum() + self.equall() + 1.5*self.wheremax() + self.has()
 
 
+def evaluate_batch(mats):
+    # TestScore.evaluate的向量化版本，和逐个计算的结果完全相同，返回(N,)的得分
+    empty, mono, allnum, equall, where, has = evaluate_parts(mats)
+    return empty + 1.2 * mono + allnum + equall + 1.5 * where + has
+
+
+def evaluate_bitboards(bbs):
+    # 输入N个bitboard的evaluate_batch
+    return evaluate_batch(bitboard.VALUES[bitboard.to_boards(bbs)])
+
+
+def vec_rollouts(bb, iters, depth, rng=np.random):
+    # 把iters次rollout放在一个(iters,4,4)的数组里同步推进，返回得分之和
+    states = np.repeat(bitboard.to_board(bb)[np.newaxis], iters, axis=0)
+    alive = np.ones(iters, dtype=bool)
+    score = 0
+    for t in range(depth):
+        if profiling.enabled:
+            t0 = profiling.clock()
+        alive &= batch_env.spawn_batch(states, rng, alive)
+        if not alive.any():
+            break
+        if profiling.enabled:
+            t1 = profiling.clock()
+            profiling.add('mc.spawn', t1 - t0, iters)
+        new_boards, _, legal = batch_env.move_all(states)
+        if profiling.enabled:
+            t2 = profiling.clock()
+            profiling.add('mc.move', t2 - t1, iters)
+        evals = evaluate_batch(bitboard.VALUES[new_boards.reshape((-1, 4, 4))]).reshape((4, iters))
+        if profiling.enabled:
+            profiling.add('mc.evaluate', profiling.clock() - t2, iters)
+        evals[~legal] = -1
+        # 和_choose_一样分数相同时取序号大的动作，都不能动时局面不变、得分为0
+        action = 3 - evals[::-1].argmax(axis=0)
+        index = np.arange(iters)
+        moved = alive & legal.any(axis=0)
+        states[moved] = new_boards[action, index][moved]
+        score += evals[action, index][moved].sum()
+    return score
+
+
+def evaluate_bitboards_cached(bbs, cache=None):
+    # evaluate_bitboards，先查cache.evals，没有的再一次算完存进去
+    if cache is None:
+        return evaluate_bitboards(bbs)
+    evals = np.array([cache.evals.get(bb, -1.0) for bb in bbs])
+    missing = np.nonzero(evals < 0)[0]
+    if len(missing):
+        evals[missing] = evaluate_bitboards([bbs[k] for k in missing])
+        for k in missing:
+            cache.evals.put(bbs[k], evals[k])
+    return evals
+
+
+def bb_greedy(bb, cache=None):
+    # 和MenterCarol._choose_一样的贪心一步，棋盘为bitboard
+    if cache is not None:
+        result = cache.moves.get(bb)
+        if result is not None:
+            return result
+    if profiling.enabled:
+        t0 = profiling.clock()
+    next_ = [bitboard.move(bb, i)[0] for i in range(4)]
+    legal = [i for i in range(4) if next_[i] != bb]
+    if profiling.enabled:
+        t1 = profiling.clock()
+        profiling.add('mc.move', t1 - t0)
+    if not legal:
+        result = bb, 0
+    else:
+        evals = evaluate_bitboards_cached([next_[i] for i in legal], cache)
+        k = len(legal) - 1 - evals[::-1].argmax()  # 分数相同时取序号大的动作
+        result = next_[legal[k]], evals[k]
+        if profiling.enabled:
+            profiling.add('mc.evaluate', profiling.clock() - t1)
+    if cache is not None:
+        cache.moves.put(bb, result)
+    return result
+
+
+def bb_rollouts(bb, iters, depth, rng=random, cache=None):
+    # 从bb开始做iters次深度为depth的随机加块+贪心rollout，返回得分之和
+    score = 0
+    for _ in range(iters):
+        state = bb
+        for t in range(depth):
+            if profiling.enabled:
+                t0 = profiling.clock()
+                state, done = bitboard.spawn(state, rng)
+                profiling.add('mc.spawn', profiling.clock() - t0)
+            else:
+                state, done = bitboard.spawn(state, rng)
+            if done:
+                break
+            state, value = bb_greedy(state, cache)
+            score += value
+    return score
+
+
+_executors = {}
+
+
+def get_executor(workers):
+    # 进程池每个进程数只建一次，建不起来时返回None，调用方退回单进程
+    if workers not in _executors:
+        try:
+            _executors[workers] = ProcessPoolExecutor(max_workers=workers)
+        except (OSError, NotImplementedError, ImportError):
+            _executors[workers] = None
+    return _executors[workers]
+
+
+def drop_executor(workers):
+    # 用的时候才发现坏掉的进程池，关掉并从缓存中去掉，下次get_executor重新建
+    executor = _executors.pop(workers, None)
+    if executor is not None:
+        try:
+            executor.shutdown(wait=False, cancel_futures=True)
+        except Exception:
+            pass
+
+
 class MenterCarol:
-    def __init__(self, matrix):
+    def __init__(self, matrix, **kw):
         self.matrix = matrix
+        self.bitboard = kw.get('bitboard', False)  # 用64位整数棋盘查表移动
+        self.workers = kw.get('workers', 0)  # 大于1时用多进程做rollout
+        self.seed = kw.get('seed')
+        self.vectorized = kw.get('vectorized', False)  # rollout用数组同步推进
+        self.rng = np.random.RandomState(self.seed)
+        # 标量rollout用的随机数，没给seed时和原来一样用random模块
+        self.random = random.Random(self.seed) if self.seed is not None else random
+        # cache.AgentCache，为None时不缓存；只用于bitboard的标量路径和根节点的得分
+        self.cache = kw.get('cache')
+        self.interrupted = False  # 上一次choose是否被stop()打断，打断时返回的动作不可靠
+
+    def _stopped(self, stop):
+        if stop is not None and stop():
+            self.interrupted = True
+        return self.interrupted
 
     def randomNew(self, mat):
         # 输入矩阵得到随机生成的下个矩阵，以及得到是否结束
+        if profiling.enabled:
+            t0 = profiling.clock()
         _value = random.choice([2, 4, 2, 2])
-        ran_list = []
-        for i in range(4):
-            for j in range(4):
-                if mat[i][j] == 0:
-                    ran_list.append((i, j))
-        if ran_list:
-            temp = random.choice(ran_list)
-            mat[temp[0]][temp[1]] = _value
+        ran_list = np.flatnonzero(mat == 0)  # 行优先顺序，和原来逐格扫描的顺序一致
+        if len(ran_list):
+            mat.flat[random.choice(ran_list)] = _value
             done = 0
         else:
             done = 1
+        if profiling.enabled:
+            profiling.add('mc.spawn', profiling.clock() - t0)
         return mat, done
 
     def _choose_(self, matr):
         self.matrix = self.matrix
-        mat = matr.copy()  # 对数形式
-        next_ = [LeftAction(mat).handleData(), RightAction(mat).handleData(),
-                 UpAction(mat).handleData(), DownAction(mat).handleData()]
-        eval_ = 0
-        action_ = 0
+        if profiling.enabled:
+            t0 = profiling.clock()
+        moves = move_kernel.move_all(matr)
+        next_ = [m[0] for m in moves]
+        legal = [i for i in range(4) if moves[i][2]]
+        if profiling.enabled:
+            t1 = profiling.clock()
+            profiling.add('mc.move', t1 - t0)
+        if not legal:
+            return next_[0], 0
+        evals = evaluate_batch([next_[i] for i in legal])
+        if profiling.enabled:
+            profiling.add('mc.evaluate', profiling.clock() - t1)
+        k = len(legal) - 1 - evals[::-1].argmax()  # 分数相同时取序号大的动作
+        return next_[legal[k]], evals[k]
+
+    def _bb_choose_(self, bb):
+        return bb_greedy(bb, self.cache)
+
+    def _bb_choose(self, iters, depth, stop=None, batch=100):
+        # 给了stop时每个动作的rollout分成batch次一份，每份之前检查一次，被打断就不再算后面的动作
+        scores = np.full(4, -10.0)
+        bb = bitboard.from_matrix(self.matrix)
+        step = iters if stop is None else batch
         for i in range(4):
-            if (next_[i] == mat).all():
+            nb, _ = bitboard.move(bb, i)
+            if nb == bb:
                 continue
-            else:
-                temp_ev = TestScore(next_[i]).evaluate()
-                if temp_ev >= eval_:
-                    action_ = i
-                    eval_ = temp_ev
-        return next_[action_], eval_
-
-    def choose(self, iters=1, depth=1):
+            score = evaluate_bitboards_cached([nb], self.cache)[0]
+            done = 0
+            while done < iters:
+                if self._stopped(stop):
+                    return scores.argmax()
+                n = min(step, iters - done)
+                if self.vectorized:
+                    score += vec_rollouts(nb, n, depth, self.rng)
+                else:
+                    score += bb_rollouts(nb, n, depth, self.random, self.cache)
+                done += n
+            scores[i] = score / iters
+        return scores.argmax()
+
+    def _parallel_choose(self, iters, depth, stop=None):
+        # 每个动作的rollout分成workers份交给进程池，每份有独立的随机种子
+        executor = get_executor(self.workers)
+        if executor is None:
+            return self._bb_choose(iters, depth, stop)
+        bb = bitboard.from_matrix(self.matrix)
+        bounds = [iters * k // self.workers for k in range(self.workers + 1)]
+        seeds = np.random.SeedSequence(self.seed).generate_state(4 * self.workers).tolist()
+        if self.vectorized:
+            rollouts, rngs = vec_rollouts, [np.random.RandomState(sd) for sd in seeds]
+        else:
+            rollouts, rngs = bb_rollouts, [random.Random(sd) for sd in seeds]
+        next_ = []
+        futures = []
+        scores = np.full(4, -10.0)
+        try:
+            for i in range(4):
+                nb, _ = bitboard.move(bb, i)
+                next_.append(nb)
+                futures.append([executor.submit(rollouts, nb, bounds[k + 1] - bounds[k], depth,
+                                                rngs[i * self.workers + k])
+                                for k in range(self.workers) if nb != bb])
+            for i in range(4):
+                if next_[i] == bb:
+                    continue
+                if self._stopped(stop):
+                    for f in itertools.chain(*futures):
+                        f.cancel()
+                    return scores.argmax()
+                score = evaluate_bitboards_cached([next_[i]], self.cache)[0]
+                score += sum(f.result() for f in futures[i])
+                scores[i] = score / iters
+        except (BrokenProcessPool, AssertionError, RuntimeError, OSError):
+            # 进程池坏了（子进程被杀、已经shutdown）或者在守护进程里开不了子进程，
+            # 这些错误要到submit/result时才出现；丢掉这个进程池，这一步退回单进程
+            for f in itertools.chain(*futures):
+                f.cancel()
+            drop_executor(self.workers)
+            return self._bb_choose(iters, depth, stop)
+        return scores.argmax()
+
+    def choose_anytime(self, deadline_ms, depth=8, batch=50, stop=None):
+        # 在deadline_ms毫秒内一轮轮地给每个动作做batch次rollout，时间到了返回目前平均得分最高的动作
+        # 第一轮总会做完，所以每个能走的动作至少有batch次rollout；stop()返回True时也提前结束，
+        # 这时interrupted为True
+        self.interrupted = False
+        with profiling.phase('mc.decision'):
+            return self._choose_anytime(deadline_ms, depth, batch, stop)
+
+    def _choose_anytime(self, deadline_ms, depth, batch, stop):
+        deadline = time.time() + deadline_ms / 1000.0
+        bb = bitboard.from_matrix(self.matrix)
+        next_ = [bitboard.move(bb, i)[0] for i in range(4)]
+        legal = [i for i in range(4) if next_[i] != bb]
+        scores = np.full(4, -10.0)
+        sums = dict((i, evaluate_bitboards_cached([next_[i]], self.cache)[0]) for i in legal)
+        counts = dict.fromkeys(legal, 0)
+        rounds = 0
+        while legal:
+            for i in legal:
+                if self.vectorized:
+                    sums[i] += vec_rollouts(next_[i], batch, depth, self.rng)
+                else:
+                    sums[i] += bb_rollouts(next_[i], batch, depth, self.random, self.cache)
+                counts[i] += batch
+                if rounds and (time.time() >= deadline or self._stopped(stop)):
+                    break
+            rounds += 1
+            if time.time() >= deadline or self._stopped(stop):
+                break
+        for i in legal:
+            scores[i] = sums[i] / counts[i]
+        self.rollouts = sum(counts.values())
+        return scores.argmax()
+
+    def choose(self, iters=1, depth=1, stop=None):
+        # stop()返回True时尽早结束，interrupted为True，返回的动作不可靠
+        self.interrupted = False
+        with profiling.phase('mc.decision'):
+            return self._choose(iters, depth, stop)
+
+    def _choose(self, iters, depth, stop=None):
+        if self.workers > 1:
+            return self._parallel_choose(iters, depth, stop)
+        if self.bitboard or self.vectorized:
+            return self._bb_choose(iters, depth, stop)
         scores = []
-        mat = self.matrix
-        next_ = [LeftAction(mat).handleData(), RightAction(mat).handleData(),
-                 UpAction(mat).handleData(), DownAction(mat).handleData()]
+        moves = move_kernel.move_all(self.matrix)
+        next_ = [m[0] for m in moves]
         for i in range(4):
-            state = next_[i]
             score = 0
-            if (state == mat).all():
+            if not moves[i][2]:
                 scores.append(-10)
                 continue
             else:
                 score += TestScore(next_[i]).evaluate()
                 for _ in range(iters):
-                    state = next_[i]
+                    if self._stopped(stop):
+                        return np.array(scores + [-10] * (4 - len(scores))).argmax()
+                    state = next_[i].copy()  # randomNew会原地修改，每次都从同一个局面开始
                     for t in range(depth):
                         s1, done = self.randomNew(state)
                         if done:
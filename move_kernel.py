@@ -0,0 +1,125 @@
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# 数值形式棋盘的移动：一次调用得到新棋盘、得分和是否变化，和move.py的四个Action类结果相同
+# 有numba时编译逐格的循环，没有时逐行查表
+
+# IDX[a][4*r+c]是动作a转换成向左移动后第r行第c格在原棋盘中的下标
+# 和engine.action_view一样翻转和转置，这里不import engine，免得rules.py带上bitboard的查表
+_CELLS = np.arange(16).reshape((4, 4))
+IDX = np.array([v.flatten() for v in (_CELLS, _CELLS[:, ::-1], _CELLS.T, _CELLS[::-1].T)], dtype=np.int64)
+
+
+def _move_into(src, dst, idx):
+    # src、dst为16格的一维数组，可以是同一个数组（原地移动）
+    # 每格只写一次，写之前原来的值已经读过，所以原地移动也不需要临时数组
+    score = 0.0
+    changed = False
+    for r in range(4):
+        base = 4 * r
+        w = 0
+        pending = 0.0
+        for c in range(4):
+            v = src[idx[base + c]]
+            if v == 0:
+                continue
+            if pending == v:
+                v = 2 * v
+                score += v
+                pending = 0.0
+            elif pending != 0:
+                v, pending = pending, v
+            else:
+                pending = v
+                continue
+            p = idx[base + w]
+            if src[p] != v:
+                changed = True
+            dst[p] = v
+            w += 1
+        if pending != 0:
+            p = idx[base + w]
+            if src[p] != pending:
+                changed = True
+            dst[p] = pending
+            w += 1
+        while w < 4:
+            p = idx[base + w]
+            if src[p] != 0:
+                changed = True
+            dst[p] = 0
+            w += 1
+    return score, changed
+
+
+def _slide_row(row):
+    # 一行数值向左滑动并合并，返回新行和得分
+    tiles = [v for v in row if v]
+    new_row = []
+    score = 0
+    i = 0
+    while i < len(tiles):
+        if i + 1 < len(tiles) and tiles[i] == tiles[i + 1]:
+            new_row.append(2 * tiles[i])
+            score += 2 * tiles[i]
+            i += 2
+        else:
+            new_row.append(tiles[i])
+            i += 1
+    return tuple(new_row + [0] * (4 - len(new_row))), score
+
+
+_ROWS = [[IDX[a][4 * r:4 * r + 4].tolist() for r in range(4)] for a in range(4)]
+_row_cache = {}  # 行的内容 -> (新行, 得分)，不同的行最多十几万种
+
+
+def _python_move_into(src, dst, action):
+    # 没有numba时逐行查缓存的结果，比每次调用十几个numpy函数快
+    vals = src.tolist()
+    new = vals[:]
+    score = 0
+    changed = False
+    for i0, i1, i2, i3 in _ROWS[action]:
+        row = (vals[i0], vals[i1], vals[i2], vals[i3])
+        result = _row_cache.get(row)
+        if result is None:
+            result = _row_cache[row] = _slide_row(row)
+        new_row, row_score = result
+        if new_row != row:
+            changed = True
+            new[i0], new[i1], new[i2], new[i3] = new_row
+            score += row_score
+    dst[:] = new
+    return score, changed
+
+
+if njit is not None:
+    _jit_move_into = njit(cache=True)(_move_into)
+
+    def _kernel(src, dst, action):
+        return _jit_move_into(src, dst, IDX[action])
+else:
+    _kernel = _python_move_into
+
+
+def move(board, action, out=None):
+    """board为4*4的数值形式，返回(新棋盘, 得分, 是否变化)，不修改board
+
+    out可以是预先分配好的4*4连续数组（也可以就是board），结果直接写进去。out必须是C连续、
+    16格、dtype和board相同，否则reshape会得到副本，结果写不回out，这时报ValueError。
+    """
+    if out is None:
+        out = np.empty_like(board, order='C')
+    elif not out.flags.c_contiguous or out.size != 16 or out.dtype != board.dtype:
+        raise ValueError("out must be a C-contiguous 16-cell array of dtype {}".format(board.dtype))
+    score, changed = _kernel(board.reshape(16), out.reshape(16), action)
+    return out, score, changed
+
+
+def move_all(board):
+    # 四个方向的结果，返回[(新棋盘, 得分, 是否变化)]
+    return [move(board, a) for a in range(4)]
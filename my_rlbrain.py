@@ -3,7 +3,12 @@ from keras.layers.core import Dense, Flatten, Activation
 from keras.layers.convolutional import Conv2D
 from keras.optimizers import RMSprop
 import numpy as np
-import move
+import tensorflow as tf
+import cache
+import npnet
+import profiling
+import rules
+from replay import BatchPrefetcher, MemmapReplayBuffer, PrioritizedReplayBuffer, ReplayBuffer
 
 
 class DqnCon:
@@ -11,9 +16,21 @@ class DqnCon:
         # s为一维向量
         self.s_shape = kw.get('s_shape', 16)
         self.a_num = kw.get('a_shape', 4)
-        self.memory_size = 2000
-        self.memory = np.zeros((self.memory_size, self.s_shape * 2 + 3))
-        self.memory_counter = 0
+        self.memory_size = kw.get('memory_size', 2000)
+        # prioritized为True时按TD误差抽样，fit时带上重要性采样权重
+        # memory_path不为空时经验存在这个文件里，下次训练接着用（只支持均匀抽样）
+        self.prioritized = kw.get('prioritized', False) and not kw.get('memory_path')
+        if kw.get('memory_path'):
+            self.memory = MemmapReplayBuffer(kw['memory_path'], self.memory_size, self.s_shape)
+        elif self.prioritized:
+            self.memory = PrioritizedReplayBuffer(self.memory_size, self.s_shape, alpha=kw.get('alpha', 0.6),
+                                                  beta=kw.get('beta', 0.4))
+        else:
+            self.memory = ReplayBuffer(self.memory_size, self.s_shape)
+        # prefetch为后台准备好的batch个数，为0时在learn里抽样；prefetch_seed不为None时不开线程、结果可复现
+        self.prefetch = kw.get('prefetch', 0)
+        self.prefetch_seed = kw.get('prefetch_seed')
+        self.prefetcher = None
         self.episilon_min = 0.05
         self.episilon = 0.1
         self.gamma = 0.90
@@ -24,6 +41,8 @@ class DqnCon:
         self.nl = 120
         self.act = 'relu'
         self.e_decrease = 0.0008
+        # ai_rule结果的LRU缓存，kw中cache为条目数，为0时不缓存
+        self.rule_cache = cache.LRUCache(kw['cache']) if kw.get('cache') else None
         # 真实Q网络
         self.real = Sequential()
         self.real.add(Conv2D(10, (3, 3), strides=(1, 1), padding='same', activation=self.act,
@@ -48,15 +67,77 @@ class DqnCon:
         self.target.add(Dense(activation=self.act, units=self.nl))
         self.target.add(Dense(units=self.a_num, activation='relu'))
         self.target.compile(loss='mse', optimizer=RMSprop(lr=0.01), )
+        # fused为True时learn的三次预测和两次fit合成一个编译好的tf.function，一次调用完成
+        # tests/test_rlbrain.py在装了tensorflow的环境里和_learn_unfused对比，通过之前默认仍然用原来的做法
+        self.fused = kw.get('fused', False)
+        self.learn_step = self._make_learn_step() if self.fused else None
+        # numpy_inference为True时选动作用numpy前向计算，每次learn后同步权重
+        self.numpy_net = npnet.NumpyNet.from_model(self.real) if kw.get('numpy_inference') else None
+        if self.numpy_net is not None:
+            # 先在随机棋盘上和keras的结果对一下，对不上就不能用numpy代替real.predict
+            boards = np.random.RandomState(0).randint(0, 12, size=(32, 4, 4, 1)).astype(np.float32)
+            if not np.allclose(self.numpy_net.predict(boards), self.real.predict(boards), rtol=1e-4, atol=1e-4):
+                raise ValueError("numpy forward pass does not match the keras model")
+
+    def _make_learn_step(self, fits=2, batch_size=32):
+        # 和learn中分开调用的版本相同：Double DQN的目标、mse损失（只有所选动作那一列有误差）、
+        # 用同一个目标训练fits次，每次和keras的fit默认一样打乱后按batch_size条一批更新
+        # （50条时每次fit更新2步），返回TD误差
+        real, target, optimizer = self.real, self.target, self.real.optimizer
+        gamma = self.gamma
+
+        @tf.function
+        def learn_step(states, states_next, actions, rewards, dones, weights):
+            n = tf.shape(states)[0]
+            q_all = real(tf.concat([states, states_next], axis=0), training=False)
+            q_eval, q_next1 = q_all[:n], q_all[n:]
+            q_next2 = target(states_next, training=False)
+            best = tf.argmax(q_next1, axis=1, output_type=tf.int32)
+            rows = tf.range(n)
+            q_next_max = tf.gather_nd(q_next2, tf.stack([rows, best], axis=1))
+            chosen = tf.stack([rows, actions], axis=1)
+            q_new = rewards + (1 - dones) * gamma * q_next_max
+            q_target = tf.tensor_scatter_nd_update(q_eval, chosen, q_new)
+            # 小批的个数按这次trace的batch大小在python里展开，apply_gradients不在tf的while循环里，
+            # 第一次trace时优化器可以正常建slot变量
+            size = states.shape[0]
+            for _ in range(fits):
+                order = tf.random.shuffle(rows)
+                for start in range(0, size, batch_size):
+                    part = order[start:start + batch_size]
+                    with tf.GradientTape() as tape:
+                        q = real(tf.gather(states, part), training=True)
+                        # keras带sample_weight的mse：每条的mse乘权重后除以这一批的条数
+                        loss = tf.reduce_mean(tf.gather(weights, part) *
+                                              tf.reduce_mean(tf.square(tf.gather(q_target, part) - q), axis=1))
+                    grads = tape.gradient(loss, real.trainable_variables)
+                    optimizer.apply_gradients(zip(grads, real.trainable_variables))
+            return q_new - tf.gather_nd(q_eval, chosen)
+
+        return learn_step
+
+    def predict(self, states):
+        if self.numpy_net is not None:
+            return self.numpy_net.predict(states)
+        return self.real.predict(states)
+
+    def export(self, path):
+        # 导出成npz，给npnet.NumpyAgent和评估用
+        npnet.export_model(self.real, path)
 
     def update_target(self):
         self.target.set_weights(self.real.get_weights())
 
+    @property
+    def memory_counter(self):
+        return self.memory.counter
+
     def store_transition(self, s, a, r, s_, done):
-        transition = np.hstack((s, [a, r], s_, done))  # 将一维的组合成一个一维的
-        index = self.memory_counter % self.memory_size
-        self.memory[index, :] = transition
-        self.memory_counter += 1
+        self.memory.store(s, a, r, s_, done)
+
+    def store_transitions(self, s, a, r, s_, done):
+        # 一次存N条，和BatchEngine.step的输出对应
+        self.memory.store_batch(s, a, r, s_, done)
 
     def choose_action(self, observation):
         observation = observation[np.newaxis, :].copy()  # 变成了二维行向量
@@ -65,42 +146,82 @@ class DqnCon:
         else:
             if observation.shape != (4, 4):
                 observation = observation.reshape((4, 4))
-            act = self.ai_rule(observation)
+            with profiling.phase('dqn.rule'):
+                act = self.ai_rule(observation)
             observation = observation.reshape((-1, 4, 4, 1))
-            cal = self.real.predict(observation)
+            with profiling.phase('dqn.inference'):
+                cal = self.predict(observation)
             q_now = act/10 + cal
             return np.argmax(q_now)
 
+    def choose_actions(self, observations):
+        # 一次为(N,16)的N个状态选动作，网络只调用一次predict
+        observations = np.asarray(observations, dtype=float).reshape((-1, 16))
+        n = len(observations)
+        with profiling.phase('dqn.rule'):
+            act = np.array([self.ai_rule(o.reshape((4, 4))) for o in observations])
+        with profiling.phase('dqn.inference'):
+            cal = self.predict(observations.reshape((-1, 4, 4, 1)))
+        actions = np.argmax(act / 10 + cal, axis=1)
+        explore = np.random.uniform(size=n) < self.episilon
+        actions[explore] = np.random.randint(self.a_num, size=explore.sum())
+        return actions
+
     def learn(self, size=50):
         if self.update_time % 100 == 0:
             print("更新target网络")
             self.update_target()
-        sample_index = np.random.choice(min(self.memory_size, self.memory_counter), size=size)
-        batch_memory = self.memory[sample_index, :]
-        observation, action, reward, observation_next, done = batch_memory[:, :self.s_shape], batch_memory[:,
-                                                                                              self.s_shape], \
-                                                              batch_memory[:, self.s_shape + 1], batch_memory[:,
-                                                                                                 -self.s_shape - 1:-1], batch_memory[
-                                                                                                                        :,
-                                                                                                                        -1]
-        observation = observation.reshape((-1, 4, 4, 1))
-        observation_next = observation_next.reshape((-1, 4, 4, 1))
-
-        batch_state = observation
-        batch_state_next = observation_next
-        batch_action = action.astype(int)
-        batch_reward = reward
-        batch_done = done.astype(int)
+        if profiling.enabled:
+            t0 = profiling.clock()
+        index = weights = since = None
+        if self.prefetch and self.prefetcher is None:
+            self.prefetcher = BatchPrefetcher(self.memory, size, self.prefetch, self.prefetch_seed,
+                                              deterministic=self.prefetch_seed is not None)
+        if self.prefetcher is not None and self.prefetcher.batch_size == size:
+            batch = self.prefetcher.get()
+            since = self.prefetcher.sampled_counter  # 抽样之后又存进来的经验不按这批的TD误差改优先级
+        else:
+            batch = self.memory.sample(size)
+        if self.prioritized:
+            batch_state, batch_action, batch_reward, batch_state_next, done, index, weights = batch
+        else:
+            batch_state, batch_action, batch_reward, batch_state_next, done = batch
+        if profiling.enabled:
+            profiling.add('dqn.sample', profiling.clock() - t0)
+        if self.learn_step is not None:
+            if weights is None:
+                weights = np.ones(size, dtype=np.float32)
+            with profiling.phase('dqn.learn_step'):
+                td_errors = self.learn_step(batch_state, batch_state_next, batch_action.astype(np.int32),
+                                            batch_reward, done.astype(np.float32), weights)
+            if self.prioritized:
+                self.memory.update_priorities(index, td_errors.numpy(), since)
+        else:
+            self._learn_unfused(batch_state, batch_action, batch_reward, batch_state_next, done, weights, index, since)
+        if self.numpy_net is not None:
+            self.numpy_net.set_weights(self.real.get_weights())
+        self.update_time += 1
+        self.episilon = self.episilon - self.e_decrease if self.episilon > self.episilon_min else self.episilon_min
 
-        q_target = self.real.predict(batch_state)
-        q_next1 = self.real.predict(batch_state_next)
-        q_next2 = self.target.predict(batch_state_next)
+    def _learn_unfused(self, batch_state, batch_action, batch_reward, batch_state_next, done, weights, index,
+                       since=None):
+        # 原来的做法：三次predict、两次fit
+        size = len(batch_state)
+        batch_done = done.astype(int)
+        with profiling.phase('dqn.learn_inference'):
+            q_target = self.real.predict(batch_state)
+            q_next1 = self.real.predict(batch_state_next)
+            q_next2 = self.target.predict(batch_state_next)
         batch_action_withMaxQ = np.argmax(q_next1, axis=1)
         batch_index11 = np.arange(size, dtype=np.int32)
         q_next_Max = q_next2[batch_index11, batch_action_withMaxQ]
+        q_eval = q_target[batch_index11, batch_action]
         q_target[batch_index11, batch_action] = batch_reward + (1 - batch_done) * self.gamma * q_next_Max
-        self.real.fit(batch_state, q_target, verbose=0)
-        self.real.fit(batch_state, q_target, verbose=0)
+        if index is not None:
+            self.memory.update_priorities(index, q_target[batch_index11, batch_action] - q_eval, since)
+        with profiling.phase('dqn.fit'):
+            self.real.fit(batch_state, q_target, sample_weight=weights, verbose=0)
+            self.real.fit(batch_state, q_target, sample_weight=weights, verbose=0)
         # q1_old = self.real.predict(observation)
         # q1_new = q1_old.copy()
         # q2 = self.target.predict(observation_next)
@@ -111,30 +232,9 @@ class DqnCon:
         #     q1_new[done == 1, j] = reward[done == 1]
         # # self.real.fit(observation, q1_new, initial_epoch=self.epoch, epochs=self.epoch + 10, verbose=0)  # 不加显示
         # self.real.fit(observation, q1_new, verbose=0)  # 不加显示
-        self.update_time += 1
-        self.episilon = self.episilon - self.e_decrease if self.episilon > self.episilon_min else self.episilon_min
 
     def get_epi(self):
         return self.episilon
 
     def ai_rule(self, mate):
-        mat = mate.copy()  # 对数形式
-        mat = 2 ** mat
-        mat[mat == 1] = 0
-        if mat.shape != (4, 4):
-            mat = mat.reshape((4, 4))
-        next_ = [move.LeftAction(mat).handleData(), move.RightAction(mat).handleData(),
-                 move.UpAction(mat).handleData(), move.DownAction(mat).handleData()]
-        sco = []
-        for st in next_:
-            if (st == mat).all():
-                sco.append(-10)
-            else:
-                st_ = move.TestScore(st)
-                sco_ = st_.EmptyTest() + st_.Monotonicity() + st_.ALLnum() + st_.equall() + st_.wheremax()
-                sco.append(sco_)
-        pp = np.array(sco)
-        # return np.array(sco)
-        mat[mat == 1] = 0
-        # mat = np.log2(mat)
-        return pp
+        return rules.rule_scores(mate, self.rule_cache)
@@ -0,0 +1,202 @@
+import argparse
+import json
+
+import numpy as np
+
+import rules
+
+# 只用numpy的DqnCon网络前向计算，不需要import tensorflow/keras
+# 网络结构存成层的列表，每层是{'type': 'conv'/'dense'/'flatten'/'activation', ...}，
+# 和权重一起存进一个npz文件
+
+_ACTIVATIONS = {
+    'linear': lambda x: x,
+    'relu': lambda x: np.maximum(x, 0),
+    'tanh': np.tanh,
+    'sigmoid': lambda x: 1 / (1 + np.exp(-x)),
+}
+
+
+def _layer_spec(layer):
+    # keras的层转成层的描述和权重
+    name = layer.__class__.__name__
+    config = layer.get_config()
+    if name == 'Conv2D':
+        if tuple(config['strides']) != (1, 1) or config.get('data_format', 'channels_last') != 'channels_last':
+            raise ValueError("only stride 1 channels_last convolutions are supported")
+        spec = {'type': 'conv', 'padding': config['padding'], 'activation': config['activation']}
+    elif name == 'Dense':
+        spec = {'type': 'dense', 'activation': config['activation']}
+    elif name == 'Flatten':
+        spec = {'type': 'flatten'}
+    elif name == 'Activation':
+        spec = {'type': 'activation', 'activation': config['activation']}
+    else:
+        raise ValueError("unsupported layer {}".format(name))
+    return spec, [np.asarray(w, dtype=np.float32) for w in layer.get_weights()]
+
+
+_IM2COL = {}
+
+
+def _im2col_index(h, w, kh, kw, padding):
+    # 第o个输出位置的第k个邻域格在输入(h*w格，最后补一个0格)中的下标，越界的指向补的0格
+    key = (h, w, kh, kw, padding)
+    if key not in _IM2COL:
+        ph, pw = ((kh - 1) // 2, (kw - 1) // 2) if padding == 'same' else (0, 0)
+        oh, ow = (h, w) if padding == 'same' else (h - kh + 1, w - kw + 1)
+        index = np.full((oh * ow, kh * kw), h * w, dtype=np.intp)
+        for i in range(oh):
+            for j in range(ow):
+                for a in range(kh):
+                    for b in range(kw):
+                        r, c = i + a - ph, j + b - pw
+                        if 0 <= r < h and 0 <= c < w:
+                            index[i * ow + j, a * kw + b] = r * w + c
+        _IM2COL[key] = index, oh, ow
+    return _IM2COL[key]
+
+
+def _conv(x, kernel, bias, padding):
+    # im2col：把每个位置的kh*kw*C的邻域排成一行，再和(kh*kw*C, F)的卷积核做一次矩阵乘法
+    # 棋盘只有4*4，下标表按输入大小缓存，每次只做一次取下标
+    n, h, w, c = x.shape
+    kh, kw, _, f = kernel.shape
+    index, oh, ow = _im2col_index(h, w, kh, kw, padding)
+    flat = np.concatenate([x.reshape((n, h * w, c)), np.zeros((n, 1, c), dtype=x.dtype)], axis=1)
+    cols = flat[:, index].reshape((n * oh * ow, kh * kw * c))
+    return (cols @ kernel.reshape((kh * kw * c, f)) + bias).reshape((n, oh, ow, f))
+
+
+class NumpyNet(object):
+    """keras网络（DqnCon.real或者m1.h5的权重）的numpy版本
+
+    支持stride为1的Conv2D、Dense、Flatten和Activation，输入为(N,4,4,1)，输出为(N,动作数)。
+    """
+
+    def __init__(self, layers, weights):
+        self.layers = layers  # 层的描述
+        self.weights = weights  # 每层的权重list
+
+    @classmethod
+    def from_model(cls, model):
+        specs = [_layer_spec(layer) for layer in model.layers]
+        return cls([s for s, _ in specs], [w for _, w in specs])
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        layers = json.loads(str(data['layers']))
+        weights = [[data['w%d_%d' % (i, k)] for k in range(layer.get('n_weights', 0))]
+                   for i, layer in enumerate(layers)]
+        return cls(layers, weights)
+
+    def save(self, path):
+        arrays = {}
+        layers = []
+        for i, (layer, weights) in enumerate(zip(self.layers, self.weights)):
+            layers.append(dict(layer, n_weights=len(weights)))
+            for k, w in enumerate(weights):
+                arrays['w%d_%d' % (i, k)] = w
+        np.savez(path, layers=np.array(json.dumps(layers)), **arrays)
+
+    def set_weights(self, weights):
+        # weights为keras的model.get_weights()，按层的顺序排列
+        weights = list(weights)
+        for i, layer_weights in enumerate(self.weights):
+            self.weights[i] = [np.asarray(weights.pop(0), dtype=np.float32) for _ in layer_weights]
+
+    def predict(self, x):
+        x = np.asarray(x, dtype=np.float32)
+        for layer, weights in zip(self.layers, self.weights):
+            kind = layer['type']
+            if kind == 'conv':
+                x = _conv(x, weights[0], weights[1], layer['padding'])
+            elif kind == 'dense':
+                if x.ndim > 2:
+                    x = x.reshape((len(x), -1))  # 没有Flatten层的旧npz，输入(N,4,4,1)直接接Dense
+                x = x @ weights[0] + weights[1]
+            elif kind == 'flatten':
+                x = x.reshape((len(x), -1))
+            if 'activation' in layer:
+                x = _ACTIVATIONS[layer['activation']](x)
+        return x
+
+
+def export_model(model, path):
+    # DqnCon.real这样的keras模型导出成npz
+    NumpyNet.from_model(model).save(path)
+
+
+def export_h5(h5_path, path, activation='relu', padding='same'):
+    """只存了权重的keras h5文件（比如m1.h5）导出成npz，需要h5py
+
+    文件里没有网络结构：4维的kernel当作Conv2D，2维的当作Dense，Dense的输入不是一维时
+    （第一层或者接在卷积后面）先加Flatten，每层的激活函数都用activation，和DqnCon一样。
+    导出后用全0的棋盘算一次前向，形状不对时报错。
+    """
+    import h5py
+    layers = []
+    weights = []
+    with h5py.File(h5_path, 'r') as f:
+        group = f['model_weights'] if 'model_weights' in f else f
+        for name in group.attrs['layer_names']:
+            name = name.decode('utf-8') if isinstance(name, bytes) else name
+            names = [n.decode('utf-8') if isinstance(n, bytes) else n
+                     for n in group[name].attrs['weight_names']]
+            if not names:
+                continue  # Flatten、Activation这些没有权重的层
+            layer_weights = [np.asarray(group[name][n], dtype=np.float32) for n in names]
+            if layer_weights[0].ndim == 4:
+                layers.append({'type': 'conv', 'padding': padding, 'activation': activation})
+            else:
+                if not layers or layers[-1]['type'] == 'conv':
+                    layers.append({'type': 'flatten'})
+                    weights.append([])
+                layers.append({'type': 'dense', 'activation': activation})
+            weights.append(layer_weights)
+    net = NumpyNet(layers, weights)
+    q = net.predict(np.zeros((1, 4, 4, 1), dtype=np.float32))
+    if q.shape != (1, 4):
+        raise ValueError("{} gives output shape {}, not (1, 4)".format(h5_path, q.shape))
+    net.save(path)
+
+
+class NumpyAgent(object):
+    """用NumpyNet选动作的DqnCon，规则得分的十分之一加上Q值，不探索
+
+    可以pickle，评估的进程里不用import tensorflow。
+    """
+
+    def __init__(self, path, **kw):
+        self.path = path
+        self.net = NumpyNet.load(path)
+        self.rule = kw.get('rule', True)  # 和DqnCon.choose_action一样加上ai_rule的得分
+
+    def choose_action(self, observation):
+        # observation为16维的2的对数
+        observation = np.asarray(observation, dtype=float).reshape((4, 4))
+        q = self.net.predict(observation.reshape((1, 4, 4, 1)))[0]
+        if self.rule:
+            q = rules.rule_scores(observation) / 10 + q
+        return int(np.argmax(q))
+
+    def __call__(self, matrix, stop=None):
+        # 和RuleAgent一样输入数值形式的矩阵
+        matrix = np.asarray(matrix, dtype=float)
+        board = np.zeros(matrix.shape)
+        board[matrix > 0] = np.log2(matrix[matrix > 0])
+        return self.choose_action(board)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="把只存了权重的keras h5文件导出成npnet用的npz")
+    parser.add_argument('h5', nargs='?', default='m1.h5')
+    parser.add_argument('out', nargs='?', default='m1.npz')
+    parser.add_argument('--activation', default='relu')
+    args = parser.parse_args()
+    export_h5(args.h5, args.out, args.activation)
+
+
+if __name__ == "__main__":
+    main()
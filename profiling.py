@@ -0,0 +1,108 @@
+import argparse
+import json
+import runpy
+import sys
+import time
+from contextlib import contextmanager
+
+# 各阶段的调用次数和累计时间。enabled为False时，埋点处只多一次全局变量判断
+enabled = False
+counters = {}
+clock = time.perf_counter
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def reset():
+    counters.clear()
+
+
+def add(name, seconds, count=1):
+    entry = counters.get(name)
+    if entry is None:
+        counters[name] = [count, seconds]
+    else:
+        entry[0] += count
+        entry[1] += seconds
+
+
+@contextmanager
+def phase(name):
+    # 给调用不频繁的阶段（网络预测、训练等）用，热点循环里直接用clock和add
+    if not enabled:
+        yield
+        return
+    start = clock()
+    try:
+        yield
+    finally:
+        add(name, clock() - start)
+
+
+def report():
+    # 按累计时间从多到少排列
+    rows = sorted(counters.items(), key=lambda x: -x[1][1])
+    return [{'phase': name, 'count': count, 'seconds': seconds,
+             'us_per_call': 1e6 * seconds / count if count else 0.0}
+            for name, (count, seconds) in rows]
+
+
+def dump(path):
+    with open(path, 'w') as f:
+        json.dump(report(), f, indent=2)
+
+
+def print_report():
+    for row in report():
+        print("%-24s %10d 次 %10.3f 秒 %10.2f 微秒/次" % (
+            row['phase'], row['count'], row['seconds'], row['us_per_call']))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="打开各阶段计时运行一个脚本，例如 python profiling.py --tool cprofile evaluation.py --games 2")
+    parser.add_argument('--tool', choices=('none', 'cprofile', 'pyinstrument'), default='none')
+    parser.add_argument('--out', default='profile_phases.json', help="各阶段计时的json")
+    parser.add_argument('--stats', default='profile.out', help="cProfile的结果文件")
+    parser.add_argument('script')
+    parser.add_argument('args', nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+    sys.argv = [args.script] + args.args
+    # 作为脚本运行时本模块是__main__，被测代码import的是另一份profiling，要打开那一份
+    import profiling
+    profiling.enable()
+    run = lambda: runpy.run_path(args.script, run_name='__main__')
+    try:
+        if args.tool == 'cprofile':
+            import cProfile
+            profiler = cProfile.Profile()
+            try:
+                profiler.runcall(run)
+            finally:
+                profiler.dump_stats(args.stats)
+        elif args.tool == 'pyinstrument':
+            from pyinstrument import Profiler
+            profiler = Profiler()
+            profiler.start()
+            try:
+                run()
+            finally:
+                profiler.stop()
+                print(profiler.output_text(unicode=True, color=False))
+        else:
+            run()
+    finally:
+        profiling.dump(args.out)
+        profiling.print_report()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+import json
+import os
+import queue
+import threading
+
+import numpy as np
+
+
+class ReplayBuffer(object):
+    """预先分配好的环形经验池
+
+    状态按2的对数存成uint8，动作uint8，奖励float32，是否结束bool，分别放在各自的数组里，
+    每条经验38字节（原来float64的一行是280字节）。满了以后从头覆盖最旧的经验。
+    存和抽样都在lock里做，BatchPrefetcher的线程抽样时不会读到写了一半的经验。
+    """
+
+    def __init__(self, capacity, s_shape=16, state_shape=(4, 4, 1)):
+        self.capacity = capacity
+        self.state_shape = tuple(state_shape)  # sample返回的每个状态的形状
+        self.states = np.zeros((capacity, s_shape), dtype=np.uint8)
+        self.actions = np.zeros(capacity, dtype=np.uint8)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.states_next = np.zeros((capacity, s_shape), dtype=np.uint8)
+        self.dones = np.zeros(capacity, dtype=bool)
+        self.counter = 0  # 一共存过多少条
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return min(self.counter, self.capacity)
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.states, self.actions, self.rewards, self.states_next, self.dones))
+
+    def store(self, s, a, r, s_, done):
+        # s、s_为2的对数形式的状态
+        with self.lock:
+            index = self.counter % self.capacity
+            self.states[index] = s
+            self.actions[index] = a
+            self.rewards[index] = r
+            self.states_next[index] = s_
+            self.dones[index] = done
+            self.counter += 1
+
+    def store_batch(self, s, a, r, s_, done):
+        # 一次存N条，参数的第一维为N；超过capacity时只留最后capacity条
+        s = np.asarray(s).reshape((len(s), -1))
+        n = len(s)
+        keep = slice(max(n - self.capacity, 0), n)
+        with self.lock:
+            index = (self.counter + np.arange(n)[keep]) % self.capacity
+            self.states[index] = s[keep]
+            self.actions[index] = np.asarray(a)[keep]
+            self.rewards[index] = np.asarray(r)[keep]
+            self.states_next[index] = np.asarray(s_).reshape((n, -1))[keep]
+            self.dones[index] = np.asarray(done)[keep]
+            self.counter += n
+
+    def overwritten_since(self, index, counter):
+        # counter为抽样时的self.counter，返回index中哪些位置之后又存了新的经验
+        written = self.counter - counter
+        if written >= self.capacity:
+            return np.ones(len(index), dtype=bool)
+        return (np.asarray(index) - counter) % self.capacity < written
+
+    def batch(self, index):
+        # 取出index处的经验，状态转成float32的(B,)+state_shape，可以直接交给网络
+        shape = (len(index),) + self.state_shape
+        return (self.states[index].astype(np.float32).reshape(shape),
+                self.actions[index].astype(np.int64),
+                self.rewards[index],
+                self.states_next[index].astype(np.float32).reshape(shape),
+                self.dones[index])
+
+    def sample(self, size, rng=np.random):
+        # 有放回地均匀抽size条，返回(状态, 动作, 奖励, 下一状态, 是否结束)
+        with self.lock:
+            return self.batch(rng.randint(len(self), size=size))
+
+
+HEADER_BYTES = 4096
+_FIELDS = (('states', 'u1', True), ('actions', 'u1', False), ('rewards', '<f4', False),
+           ('states_next', 'u1', True), ('dones', '|b1', False))
+
+
+class MemmapReplayBuffer(ReplayBuffer):
+    """存在磁盘文件里的经验池，用numpy.memmap读写，程序退出后还在，下次接着用
+
+    文件开头HEADER_BYTES字节是json头（容量、状态维数、各数组的dtype、形状和偏移），
+    之后是8字节的写入计数counter，再之后是各个数组。counter也是memmap的，
+    写入进程每存一条就更新（先写数据后更新计数），readonly=True打开的进程
+    （比如多个learner）能看到新的经验。
+    """
+
+    def __init__(self, path, capacity=None, s_shape=16, state_shape=(4, 4, 1), readonly=False):
+        self.path = path
+        self.state_shape = tuple(state_shape)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                header = json.loads(f.read(HEADER_BYTES).decode('utf-8'))
+            if capacity is not None and capacity != header['capacity']:
+                raise ValueError("{} has capacity {}, not {}".format(path, header['capacity'], capacity))
+        elif readonly:
+            raise IOError("no replay file {}".format(path))
+        elif capacity is None:
+            raise ValueError("capacity is required to create {}".format(path))
+        else:
+            header = self._create(path, capacity, s_shape)
+        self.capacity = header['capacity']
+        self.lock = threading.RLock()
+        mode = 'r' if readonly else 'r+'
+        self._counter = np.memmap(path, dtype='<i8', mode=mode, offset=HEADER_BYTES, shape=(1,))
+        for name, dtype, shape, offset in header['fields']:
+            setattr(self, name, np.memmap(path, dtype=dtype, mode=mode, offset=offset, shape=tuple(shape)))
+
+    @staticmethod
+    def _create(path, capacity, s_shape):
+        fields = []
+        offset = HEADER_BYTES + 64
+        for name, dtype, is_state in _FIELDS:
+            shape = [capacity, s_shape] if is_state else [capacity]
+            fields.append([name, dtype, shape, offset])
+            offset += np.dtype(dtype).itemsize * int(np.prod(shape))
+            offset = (offset + 63) // 64 * 64
+        header = {'version': 1, 'capacity': capacity, 's_shape': s_shape, 'fields': fields}
+        data = json.dumps(header).encode('utf-8')
+        if len(data) > HEADER_BYTES:
+            raise ValueError("replay header too long")
+        with open(path, 'wb') as f:
+            f.write(data.ljust(HEADER_BYTES, b' '))
+            f.truncate(offset)  # 稀疏文件，计数和数组都从0开始
+        return header
+
+    @property
+    def counter(self):
+        return int(self._counter[0])
+
+    @counter.setter
+    def counter(self, value):
+        self._counter[0] = value
+
+    def flush(self):
+        for name, _, _ in _FIELDS:
+            getattr(self, name).flush()
+        self._counter.flush()
+
+
+class SumTree(object):
+    """完全二叉树，叶子存优先级，内部节点存子树之和
+
+    tree[1]是根，叶子i在tree[leaves + i]。更新和按前缀和查找都是O(log N)，
+    并且一次处理一批下标。
+    """
+
+    def __init__(self, capacity):
+        self.leaves = 1
+        while self.leaves < capacity:
+            self.leaves *= 2
+        self.tree = np.zeros(2 * self.leaves)
+
+    def total(self):
+        return self.tree[1]
+
+    def get(self, index):
+        return self.tree[self.leaves + np.asarray(index)]
+
+    def update(self, index, priorities):
+        # 下标可以重复，重复时以最后一个为准
+        if np.ndim(index) == 0:
+            # 每步存一条经验时走这里，用整数逐层往上加，比每层调用unique快得多
+            tree = self.tree
+            node = self.leaves + int(index)
+            tree[node] = priorities
+            node //= 2
+            while node >= 1:
+                tree[node] = tree[2 * node] + tree[2 * node + 1]
+                node //= 2
+            return
+        nodes = self.leaves + np.asarray(index)
+        self.tree[nodes] = priorities
+        nodes = np.unique(nodes // 2)
+        while nodes[0] >= 1:
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+            nodes = np.unique(nodes // 2)
+
+    def find(self, values):
+        # 对每个value找前缀和第一次超过value的叶子，value在[0, total)内
+        values = np.array(values, dtype=float)
+        nodes = np.ones(len(values), dtype=np.int64)
+        while nodes[0] < self.leaves:
+            left = self.tree[2 * nodes]
+            right = values >= left
+            values -= left * right
+            nodes = 2 * nodes + right
+        return nodes - self.leaves
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    """按TD误差的优先级抽样的经验池
+
+    抽到第i条的概率正比于(|TD误差| + eps) ** alpha，返回的重要性采样权重为
+    (N * P(i)) ** -beta / 最大权重，beta每次抽样增加beta_increment直到1。
+    新存的经验用目前最大的优先级，保证至少被抽到一次。SumTree的更新和查找也在lock里。
+    """
+
+    def __init__(self, capacity, s_shape=16, state_shape=(4, 4, 1), **kw):
+        super(PrioritizedReplayBuffer, self).__init__(capacity, s_shape, state_shape)
+        self.alpha = kw.get('alpha', 0.6)
+        self.beta = kw.get('beta', 0.4)
+        self.beta_increment = kw.get('beta_increment', 0.001)
+        self.eps = kw.get('eps', 0.01)
+        self.tree = SumTree(capacity)
+        self.max_priority = 1.0
+
+    def store(self, s, a, r, s_, done):
+        with self.lock:
+            self.tree.update(self.counter % self.capacity, self.max_priority ** self.alpha)
+            super(PrioritizedReplayBuffer, self).store(s, a, r, s_, done)
+
+    def store_batch(self, s, a, r, s_, done):
+        n = min(len(s), self.capacity)
+        with self.lock:
+            index = (self.counter + len(s) - n + np.arange(n)) % self.capacity
+            self.tree.update(index, self.max_priority ** self.alpha)
+            super(PrioritizedReplayBuffer, self).store_batch(s, a, r, s_, done)
+
+    def sample(self, size, rng=np.random):
+        # 分层抽样：把总优先级分成size段，每段里抽一条
+        # 返回(状态, 动作, 奖励, 下一状态, 是否结束, 下标, 重要性采样权重)
+        with self.lock:
+            total = self.tree.total()
+            values = (np.arange(size) + rng.random_sample(size)) * (total / size)
+            index = np.minimum(self.tree.find(np.minimum(values, np.nextafter(total, 0))), len(self) - 1)
+            probs = self.tree.get(index) / total
+            weights = (len(self) * probs) ** -self.beta
+            weights = (weights / weights.max()).astype(np.float32)
+            self.beta = min(1.0, self.beta + self.beta_increment)
+            return self.batch(index) + (index, weights)
+
+    def update_priorities(self, index, td_errors, since=None):
+        # since为抽样时的counter（BatchPrefetcher.sampled_counter），抽样之后被新经验覆盖的位置不更新，
+        # 新经验保留最大优先级
+        index = np.asarray(index)
+        priorities = np.abs(td_errors) + self.eps
+        with self.lock:
+            if since is not None:
+                keep = ~self.overwritten_since(index, since)
+                index, priorities = index[keep], priorities[keep]
+                if not len(index):
+                    return
+            self.max_priority = max(self.max_priority, priorities.max())
+            self.tree.update(index, priorities ** self.alpha)
+
+
+class BatchPrefetcher(object):
+    """后台线程不停地从经验池抽batch_size条、准备好float32的数组，放进最多depth个的队列
+
+    训练时get()直接取准备好的batch，抽样和整理数组的时间和上一次训练重叠。
+    抽样时用的是当时经验池里的内容，取到的batch最多比现在旧depth批；
+    PrioritizedReplayBuffer的优先级更新也要晚depth批才影响抽样。get()之后sampled_counter为
+    这一批抽样时经验池的counter，交给update_priorities的since，跳过这期间被覆盖的位置。
+    deterministic=True时不开线程，get()时才用seed的随机数抽样，结果可以复现。
+    """
+
+    def __init__(self, memory, batch_size=50, depth=4, seed=None, deterministic=False):
+        self.memory = memory
+        self.batch_size = batch_size
+        self.rng = np.random.RandomState(seed)
+        self.deterministic = deterministic
+        self.batches = queue.Queue(maxsize=depth)
+        self.stopped = threading.Event()
+        self.sampled_counter = None
+        self.thread = None
+        if not deterministic:
+            self.thread = threading.Thread(target=self._run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def _sample(self):
+        with self.memory.lock:
+            counter = self.memory.counter
+            batch = self.memory.sample(self.batch_size, self.rng)
+        return counter, tuple(np.ascontiguousarray(a) for a in batch)
+
+    def _run(self):
+        while not self.stopped.is_set():
+            if not len(self.memory):
+                self.stopped.wait(0.01)  # 经验池还是空的
+                continue
+            batch = self._sample()
+            while not self.stopped.is_set():
+                try:
+                    self.batches.put(batch, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+
+    def get(self):
+        # 返回和memory.sample(batch_size)相同格式的一批
+        if self.deterministic:
+            self.sampled_counter, batch = self._sample()
+        else:
+            self.sampled_counter, batch = self.batches.get()
+        return batch
+
+    def close(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join(timeout=1)
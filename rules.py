@@ -0,0 +1,56 @@
+import numpy as np
+
+import move_kernel
+
+# TestScore的向量化评估和DqnCon的规则得分，只依赖numpy和move_kernel，
+# npnet、actor_learner这些不需要bitboard查表的模块import这里很快
+
+_MONO_ROW_WEIGHT = np.arange(3).reshape((1, 3, 1))  # score1中第i行的权重i
+_MONO_COL_WEIGHT = (4 - np.arange(3)).reshape((1, 1, 3))  # score2中第j列的权重4-j
+
+
+def evaluate_parts(mats):
+    # TestScore各项的向量化版本，mats为(N,4,4)的数值形式
+    # 返回EmptyTest、Monotonicity、ALLnum、equall、wheremax、has六项，每项为(N,)
+    mats = np.asarray(mats, dtype=float)
+    n = len(mats)
+    empty = (mats == 0).sum(axis=(1, 2)) * 110
+    score1 = ((mats[:, 1:, :] >= mats[:, :-1, :]) * _MONO_ROW_WEIGHT).sum(axis=(1, 2))
+    score2 = ((mats[:, :, 1:] <= mats[:, :, :-1]) * _MONO_COL_WEIGHT).sum(axis=(1, 2))
+    mono = (score1 + score2) * 5
+    allnum = mats.sum(axis=(1, 2)) / 2
+    same = mats[:, :, 1:] == mats[:, :, :-1]
+    equall = (mats[:, :, :-1] * same).sum(axis=(1, 2)) * 5
+    flat = mats.reshape((n, 16))
+    corner = flat.argmax(axis=1) == 12
+    c1 = corner & (mats[:, 2, 0] >= 256)
+    c2 = c1 & (mats[:, 1, 0] >= 128)
+    c3 = c2 & (mats[:, 0, 0] >= 64)
+    c4 = c3 & (mats[:, 0, 1] >= 64)
+    where = (180 * corner + 120 * c1 + 120 * c2 + 120 * c3 + 120 * c4) * 1.5
+    has = (flat == 2048).any(axis=1) * 1000
+    return empty, mono, allnum, equall, where, has
+
+
+def rule_scores(mate, cache=None):
+    # DqnCon的规则得分：四个动作后继局面的TestScore（不含has项，各项权重为1），不能走的为-10
+    # mate为2的对数形式，cache为LRUCache时按bitboard（和bitboard.from_matrix相同的64位整数）缓存
+    if cache is not None:
+        key = 0
+        for i, e in enumerate(np.asarray(mate).ravel().tolist()):
+            key |= int(e) << (4 * i)
+        pp = cache.get(key)
+        if pp is not None:
+            return pp.copy()
+    mat = 2 ** mate  # 对数形式
+    mat[mat == 1] = 0
+    if mat.shape != (4, 4):
+        mat = mat.reshape((4, 4))
+    moves = move_kernel.move_all(mat)
+    # 四个后继局面一次算完TestScore各项
+    empty, mono, allnum, equall, where, _ = evaluate_parts([m[0] for m in moves])
+    pp = empty + mono + allnum + equall + where
+    pp[[not m[2] for m in moves]] = -10
+    if cache is not None:
+        cache.put(key, pp.copy())
+    return pp
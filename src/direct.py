@@ -1,91 +1,165 @@
-import math
-from merge_game import *
-from logic import *
-import itertools
+import time
 import numpy as np
 
+import bitboard
+import symmetry
+from cache import LRUCache, SymmetricCache
 
-def direction(matrix):
-    def search(matrix, depth, move=False):
-        # if on leave node return the score or if the game is over
-        l = game_state(matrix)
+# 加块的概率，和Game2048Grid.pop_tile的random.choice([2, 4, 2, 2])一致
+TILE_PROBS = ((1, 0.75), (2, 0.25))
+# choose_anytime逐步加深的上限，实际上总是先用完时间
+MAX_DEPTH = 20
 
-        if(l == 'win' or l == 'lose'):
-            l = 1
-        else:
-            l = 0
 
-        if depth == 0 or (move and l):
-            return heuristic(matrix)
+def _row_tables():
+    # heuristic按行拆开查表：权重分、相邻差的惩罚、非空格数
+    rows = np.arange(65536)
+    cells = (rows[:, np.newaxis] >> np.array([0, 4, 8, 12])) & bitboard.CELL_MASK
+    values = np.where(cells > 0, 2 ** cells, 0).astype(np.int64)
+    weights = 4 ** (6 - np.arange(4))
+    score = (values * weights).sum(axis=1)
+    penalty = 2 * np.abs(np.diff(values, axis=1)).sum(axis=1)
+    filled = (cells > 0).sum(axis=1)
+    return score.tolist(), penalty.tolist(), filled.tolist()
+
+
+_ROW_SCORE, _ROW_PENALTY, _ROW_FILLED = _row_tables()
+
+
+def heuristic(bb):
+    # 原来的score - penalty：左上角权重最大，相邻格子差越大惩罚越多，非空格有奖励
+    # 第r行的权重是第0行的4^-r倍
+    h = 0
+    t = bitboard.transpose(bb)
+    for r in range(4):
+        row = (bb >> (16 * r)) & bitboard.ROW_MASK
+        h += (_ROW_SCORE[row] >> (2 * r)) - _ROW_PENALTY[row] + 2 * _ROW_FILLED[row]
+        h -= _ROW_PENALTY[(t >> (16 * r)) & bitboard.ROW_MASK]
+    return h
+
+
+def symmetric_heuristic(bb):
+    # 8个对称局面heuristic的最大值，对称的局面得分相同，可以用SymmetricCache
+    return max(heuristic(b) for b in symmetry.symmetries(bb))
+
 
-        alpha = heuristic(matrix)
+class _Timeout(Exception):
+    pass
 
-        if move:
-            for _, action in MERGE_FUNCTIONS.items():
-                child = action(matrix)
-                alpha = max(alpha, search(child, depth - 1))
 
+class Expectimax(object):
+    """在bitboard上做expectimax搜索
+
+    depth按层数计，max层和chance层各算一层，和原来的search一样；置换表以局面为键，
+    存搜索过的最深的结果。到达局面的累计概率低于prob_threshold的chance节点不再展开。
+    choose时给了time_limit（秒）就从depth=2开始逐步加深，用完时间返回最后完成的结果。
+    """
+
+    def __init__(self, **kw):
+        self.depth = kw.get('depth', 4)
+        self.prob_threshold = kw.get('prob_threshold', 0.0001)
+        self.time_limit = kw.get('time_limit')
+        self.symmetric = kw.get('symmetric', False)
+        table_size = kw.get('table_size', 1000000)
+        if self.symmetric:
+            self.heuristic = symmetric_heuristic
+            self.table = SymmetricCache(table_size)
         else:
-            alpha = 0
-            zeros = [(i, j) for i, j in itertools.product(
-                range(4), range(4)) if matrix[i][j] == 0]
-            for i, j in zeros:
-                c1 = [[x for x in row] for row in matrix]
-                c2 = [[x for x in row] for row in matrix]
-                c1[i][j] = 2
-                c2[i][j] = 4
-                alpha += (.9 * search(c1, depth - 1, True) / len(zeros) +
-                          .1 * search(c2, depth - 1, True) / len(zeros))
+            self.heuristic = heuristic
+            self.table = LRUCache(table_size)
+        self.deadline = None
+        self.stop = None  # 返回True时中断搜索的函数
+        self.interrupted = False  # 上一次choose是否被stop()打断（超时不算）
+        self.nodes = 0
+        self.finished_depth = 0
+
+    def _check_time(self):
+        if self.deadline is not None and time.time() > self.deadline:
+            raise _Timeout()
+        if self.stop is not None and self.stop():
+            self.interrupted = True
+            raise _Timeout()
+
+    def _max_node(self, bb, depth, prob):
+        # 和原来一样至少取当前局面的heuristic
+        alpha = self.heuristic(bb)
+        if depth == 0:
+            return alpha
+        for i in range(4):
+            child, _ = bitboard.move(bb, i)
+            if child != bb:
+                alpha = max(alpha, self._chance_node(child, depth - 1, prob))
+        return alpha
+
+    def _chance_node(self, bb, depth, prob):
+        self.nodes += 1
+        if not self.nodes % 256:
+            self._check_time()
+        if depth == 0 or prob < self.prob_threshold:
+            return self.heuristic(bb)
+        entry = self.table.get(bb)
+        if entry is not None and entry[0] >= depth:
+            return entry[1]
+        cells = bitboard.empty_cells(bb)
+        alpha = 0
+        for i in cells:
+            for tile, tile_prob in TILE_PROBS:
+                child = bb | (tile << (4 * i))
+                alpha += tile_prob * self._max_node(child, depth - 1, prob * tile_prob / len(cells))
+        alpha /= len(cells)
+        self.table.put(bb, (depth, alpha))
         return alpha
 
-    def check(a, b):
-        if(a * b == 0):
-            return 1
-        if(a == 2 * b or b == 2 * a):
-            return -1
-        return 1
-
-    def heuristic(matrix):
-        def score(matrix):
-            weight = [[pow(4, 6), pow(4, 5), pow(4, 4), pow(4, 3)], [pow(4, 5), pow(4, 4), pow(4, 3), pow(4, 2)], [pow(4, 4), pow(4, 3),
-                                                                                                                   pow(4, 2), pow(4, 1)], [pow(4, 3), pow(4, 2), pow(4, 1), pow(4, 0)]]
-            sco = 0
-            for i in range(0, 4):
-                for j in range(0, 4):
-
-                    sco = sco + int(weight[i][j]) * int(matrix[i][j])
-            return sco
-
-        def penalty(matrix):
-
-            pen = 0
-            li = [-1, 1]
-            for i in range(0, 4):
-                for j in range(0, 4):
-                    if (i - 1 >= 0):
-                        pen += abs(matrix[i][j] - matrix[i - 1][j])
-                    if (i + 1 < 4):
-                        pen += abs(matrix[i][j] - matrix[i + 1][j])
-                    if (j - 1 >= 0):
-                        pen += abs(matrix[i][j] - matrix[i][j - 1])
-                    if (j + 1 < 4):
-                        pen += abs(matrix[i][j] - matrix[i][j + 1])
-
-            pen2 = 0  # for not empty tiles
-            for i in range(0, 4):
-                for j in range(0, 4):
-                    if(matrix[i][j]):
-                        pen2 = pen2 + 1
-
-            return pen - 2 * pen2
-
-        return score(matrix) - penalty(matrix)
-
-    results = []
-    for direction, action in MERGE_FUNCTIONS.items():
-        if matrix != action(matrix):
-            result = direction, search(action(matrix), 4)
-
-            results.append(result)
-    print(results)
-    return max(results, key=lambda x: x[1])[0]
+    def search(self, bb, depth):
+        # 返回四个动作的期望得分，不能移动的动作为-inf
+        scores = np.full(4, -np.inf)
+        for i in range(4):
+            child, _ = bitboard.move(bb, i)
+            if child != bb:
+                scores[i] = self._chance_node(child, depth, 1.0)
+        return scores
+
+    def choose(self, matrix, time_limit=None, max_depth=None, stop=None):
+        # matrix为数值形式的4*4矩阵（和MenterCarol一样），返回动作0,1,2,3
+        # stop()返回True时中断，和超时一样返回最后算完的一层的结果
+        bb = bitboard.from_matrix(matrix)
+        time_limit = self.time_limit if time_limit is None else time_limit
+        max_depth = self.depth if max_depth is None else max_depth
+        self.nodes = 0
+        self.finished_depth = 0
+        self.stop = stop
+        self.interrupted = False
+        if time_limit is None:
+            self.deadline = None
+            depths = [max_depth]
+        else:
+            self.deadline = time.time() + time_limit
+            depths = range(2, max_depth + 1, 2)
+        scores = None
+        try:
+            for depth in depths:
+                scores = self.search(bb, depth)
+                self.finished_depth = depth
+        except _Timeout:
+            pass
+        finally:
+            self.deadline = None
+            self.stop = None
+        if scores is None:
+            # 最浅的一层也没算完，按一步之后的heuristic选
+            scores = np.full(4, -np.inf)
+            for i in range(4):
+                child, _ = bitboard.move(bb, i)
+                if child != bb:
+                    scores[i] = self.heuristic(child)
+            self.finished_depth = 0
+        return int(scores.argmax())
+
+    def choose_anytime(self, matrix, deadline_ms, max_depth=MAX_DEPTH, stop=None):
+        # 在deadline_ms毫秒内不断加深，返回最后算完的一层的最优动作
+        return self.choose(matrix, time_limit=deadline_ms / 1000.0, max_depth=max_depth, stop=stop)
+
+
+def direction(matrix):
+    # 原来的入口：深度为4的expectimax，返回动作0,1,2,3（left,right,up,down）
+    return Expectimax(depth=4).choose(matrix)
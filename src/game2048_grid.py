@@ -349,6 +349,22 @@ class Game2048Grid(GG.GameGrid):
 
     # end def
 
+    def show_matrix(self, matrix):
+        # 按照无界面引擎的矩阵重画所有方块，matrix为数值形式
+        self.reset_grid()
+        for _row in range(self.rows):
+            for _column in range(self.columns):
+                _value = int(matrix[_row][_column])
+                if _value:
+                    _tile = Game2048GridTile(self, _value, _row, _column, 1)
+                    _tile.animate_show()
+                    self.register_tile(_tile.id, _tile)
+                    self.matrix.add(_tile, *_tile.row_column, raise_error=True)
+                    # end if
+                    # end for
+
+    # end def
+
     def set_score_callback(self, callback, raise_error=False):
         if callable(callback):
             self.__score_callback = callback
@@ -0,0 +1,94 @@
+import numpy as np
+
+import bitboard
+
+# 正方形的8种旋转/翻转。第t种变换依次做：t&1左右翻转，t&2上下翻转，t&4转置
+# 变换后的棋盘上动作要换成对应的动作：左右翻转时left<->right，上下翻转时up<->down，
+# 转置时left<->up、right<->down（action 0,1,2,3 left,right,up,down）
+_FLIP_H = (1, 0, 2, 3)
+_FLIP_V = (0, 1, 3, 2)
+_TRANSPOSE = (2, 3, 0, 1)
+
+_ROW_REVERSE = [bitboard._reverse_row(row) for row in range(65536)]
+
+
+def flip_h(bb):
+    # 每一行左右翻转
+    new_bb = 0
+    for r in range(4):
+        new_bb |= _ROW_REVERSE[(bb >> (16 * r)) & bitboard.ROW_MASK] << (16 * r)
+    return new_bb
+
+
+def flip_v(bb):
+    # 行的顺序上下翻转
+    new_bb = 0
+    for r in range(4):
+        new_bb |= ((bb >> (16 * r)) & bitboard.ROW_MASK) << (16 * (3 - r))
+    return new_bb
+
+
+def _compose(*perms):
+    action = list(range(4))
+    for perm in perms:
+        action = [perm[a] for a in action]
+    return tuple(action)
+
+
+# ACTION_MAP[t][a]：原棋盘上的动作a在第t种变换后的棋盘上对应的动作
+ACTION_MAP = tuple(
+    _compose(*[p for bit, p in ((1, _FLIP_H), (2, _FLIP_V), (4, _TRANSPOSE)) if t & bit])
+    for t in range(8)
+)
+# INVERSE_ACTION_MAP[t][c]：变换后棋盘上的动作c对应原棋盘上的动作
+INVERSE_ACTION_MAP = tuple(tuple(m.index(c) for c in range(4)) for m in ACTION_MAP)
+
+
+def transform(bb, t):
+    if t & 1:
+        bb = flip_h(bb)
+    if t & 2:
+        bb = flip_v(bb)
+    if t & 4:
+        bb = bitboard.transpose(bb)
+    return bb
+
+
+def inverse_transform(bb, t):
+    # 每一步都是对合，倒着做一遍就是逆变换
+    if t & 4:
+        bb = bitboard.transpose(bb)
+    if t & 2:
+        bb = flip_v(bb)
+    if t & 1:
+        bb = flip_h(bb)
+    return bb
+
+
+def symmetries(bb):
+    # 8种变换后的棋盘，第t个为transform(bb, t)
+    h = flip_h(bb)
+    v = flip_v(bb)
+    hv = flip_v(h)
+    images = [bb, h, v, hv]
+    return images + [bitboard.transpose(b) for b in images]
+
+
+def canonical(bb):
+    # 8个对称局面中整数最小的作为代表，返回代表和所用的变换t
+    images = symmetries(bb)
+    c = min(images)
+    return c, images.index(c)
+
+
+def to_canonical_actions(values, t):
+    # 原棋盘上按动作排列的值换到代表局面的动作顺序
+    values = np.asarray(values)
+    out = np.empty_like(values)
+    out[list(ACTION_MAP[t])] = values
+    return out
+
+
+def from_canonical_actions(values, t):
+    # 代表局面上按动作排列的值换回原棋盘的动作顺序
+    return np.asarray(values)[list(ACTION_MAP[t])]
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('tensorflow')
+pytest.importorskip('my_rlbrain')
+
+import actor_learner
+
+
+class _RecordingLearner(actor_learner.ActorLearner):
+    # 记下每次发给推理进程的权重
+    def __init__(self, *args, **kw):
+        super(_RecordingLearner, self).__init__(*args, **kw)
+        self.published = []
+
+    def publish(self):
+        self.published.append(self.brain.real.get_weights())
+        super(_RecordingLearner, self).publish()
+
+
+def test_learner_trains_and_publishes():
+    runner = _RecordingLearner(2, warmup=50, learn_every=4, publish_every=2, seed=0,
+                               brain_kw={'memory_size': 500})
+    initial = runner.brain.real.get_weights()
+    episodes = runner.run(episodes=2, verbose=False)
+    assert len(episodes) >= 2
+    assert runner.brain.memory_counter > 50
+    assert runner.learn_steps > 0
+    assert runner.published
+    assert any(not np.allclose(a, b) for a, b in zip(initial, runner.published[-1]))
+    assert not runner.server.is_alive()
@@ -0,0 +1,54 @@
+import time
+
+import numpy as np
+import pytest
+
+from ai_worker import AIWorker, RuleAgent
+
+
+class _FailingAgent(object):
+    def __call__(self, matrix, stop=None):
+        raise RuntimeError("boom")
+
+
+def _board():
+    m = np.zeros((4, 4))
+    m[3, 0] = 64
+    m[2, 0] = 8
+    m[0, 1] = 2
+    return m
+
+
+def _wait(worker, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        action = worker.poll()
+        if action is not None:
+            return action
+        time.sleep(0.005)
+    raise AssertionError("no result")
+
+
+@pytest.mark.parametrize('mode', ['thread', 'process'])
+def test_agent_error_is_raised_by_poll(mode):
+    worker = AIWorker(_FailingAgent(), mode)
+    try:
+        worker.submit(_board())
+        with pytest.raises(RuntimeError):
+            _wait(worker)
+        assert not worker.busy()
+        assert worker.alive()
+    finally:
+        worker.stop()
+
+
+def test_process_worker_with_rollout_pool():
+    # 守护进程不能开进程池，AIWorker在进程模式下改成单进程rollout
+    agent = RuleAgent(workers=2, iters=20, depth=4)
+    worker = AIWorker(agent, 'process')
+    try:
+        worker.submit(_board())
+        assert 0 <= _wait(worker) < 4
+    finally:
+        worker.stop()
+    assert agent.workers == 2
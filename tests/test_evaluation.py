@@ -0,0 +1,20 @@
+import pytest
+
+import evaluation
+from ai_worker import RuleAgent
+
+
+@pytest.mark.parametrize('agent_kw', [
+    {'iters': 20, 'depth': 4},
+    {'iters': 20, 'depth': 4, 'vectorized': False, 'cache': 10000},
+    {'agent': 'expectimax', 'depth': 2},
+])
+def test_same_seed_same_result(agent_kw):
+    agent = RuleAgent(**agent_kw)
+    first = evaluation.play_game(agent, 5, max_moves=80)
+    evaluation.play_game(agent, 6, max_moves=80)  # 中间玩过别的局也不影响
+    again = evaluation.play_game(agent, 5, max_moves=80)
+    fresh = evaluation.play_game(RuleAgent(**agent_kw), 5, max_moves=80)
+    for result in (again, fresh):
+        assert (result['score'], result['moves'], result['max_tile']) == \
+            (first['score'], first['moves'], first['max_tile'])
@@ -0,0 +1,66 @@
+import multiprocessing
+
+import numpy as np
+import pytest
+
+import move
+import move_kernel
+
+
+def _board():
+    m = np.zeros((4, 4))
+    m[3, 0] = 64
+    m[2, 0] = 8
+    m[0, 1] = 2
+    return m
+
+
+def test_parallel_choose_stopped_on_entry():
+    mc = move.MenterCarol(_board(), workers=2, seed=0)
+    action = mc.choose(100, 4, stop=lambda: True)
+    assert 0 <= action < 4
+    assert mc.interrupted
+
+
+def test_parallel_choose_without_stop():
+    mc = move.MenterCarol(_board(), workers=2, seed=0)
+    assert 0 <= mc.choose(20, 4) < 4
+    assert not mc.interrupted
+
+
+def test_parallel_choose_falls_back_when_pool_is_shut_down():
+    move.get_executor(3).shutdown()
+    mc = move.MenterCarol(_board(), workers=3, seed=0)
+    assert 0 <= mc.choose(20, 4) < 4
+    assert 3 not in move._executors
+
+
+def _choose_in_daemon(results):
+    results.put(int(move.MenterCarol(_board(), workers=2, seed=0).choose(20, 4)))
+
+
+def test_parallel_choose_in_daemon_process():
+    # 守护进程不能开子进程，submit时才报错，要退回单进程
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    p = ctx.Process(target=_choose_in_daemon, args=(results,))
+    p.daemon = True
+    p.start()
+    try:
+        assert 0 <= results.get(timeout=60) < 4
+    finally:
+        p.join(timeout=10)
+
+
+def test_kernel_move_into_out():
+    board = _board()
+    out = np.empty((4, 4))
+    result, score, changed = move_kernel.move(board, 0, out)
+    assert result is out and changed
+    np.testing.assert_array_equal(out, move_kernel.move(board, 0)[0])
+
+
+@pytest.mark.parametrize('out', [np.empty((4, 8))[:, ::2], np.empty((4, 4)).T, np.empty((4, 4), dtype=np.uint8)])
+def test_kernel_rejects_out_it_cannot_write(out):
+    with pytest.raises(ValueError):
+        move_kernel.move(_board(), 0, out)
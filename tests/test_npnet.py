@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+import npnet
+
+
+def _dense_net(rng):
+    # m1.h5那样只有Dense的网络，导出时第一层前面加了Flatten
+    layers = [{'type': 'flatten'}, {'type': 'dense', 'activation': 'relu'}, {'type': 'dense', 'activation': 'linear'}]
+    weights = [[], [rng.randn(16, 8).astype(np.float32), rng.randn(8).astype(np.float32)],
+               [rng.randn(8, 4).astype(np.float32), rng.randn(4).astype(np.float32)]]
+    return npnet.NumpyNet(layers, weights)
+
+
+def test_save_load_round_trip(tmp_path):
+    rng = np.random.RandomState(0)
+    net = _dense_net(rng)
+    path = str(tmp_path / 'net.npz')
+    net.save(path)
+    x = rng.randint(0, 12, size=(5, 4, 4, 1)).astype(np.float32)
+    np.testing.assert_array_equal(npnet.NumpyNet.load(path).predict(x), net.predict(x))
+
+
+def test_dense_without_flatten_accepts_boards():
+    # 旧版export_h5导出的npz没有Flatten层
+    rng = np.random.RandomState(0)
+    net = _dense_net(rng)
+    old = npnet.NumpyNet(net.layers[1:], net.weights[1:])
+    x = rng.randint(0, 12, size=(3, 4, 4, 1)).astype(np.float32)
+    np.testing.assert_array_equal(old.predict(x), net.predict(x))
+
+
+def test_matches_keras_dqncon():
+    pytest.importorskip('tensorflow')
+    my_rlbrain = pytest.importorskip('my_rlbrain')
+    dqn = my_rlbrain.DqnCon()
+    x = np.random.RandomState(1).randint(0, 12, size=(64, 4, 4, 1)).astype(np.float32)
+    net = npnet.NumpyNet.from_model(dqn.real)
+    np.testing.assert_allclose(net.predict(x), dqn.real.predict(x), rtol=1e-4, atol=1e-4)
+    # set_weights之后仍然一致
+    dqn.real.set_weights([w * 0.5 for w in dqn.real.get_weights()])
+    net.set_weights(dqn.real.get_weights())
+    np.testing.assert_allclose(net.predict(x), dqn.real.predict(x), rtol=1e-4, atol=1e-4)
@@ -0,0 +1,68 @@
+import threading
+
+import numpy as np
+import pytest
+
+from replay import BatchPrefetcher, PrioritizedReplayBuffer, ReplayBuffer
+
+
+def _row(k):
+    # 每条经验的各个字段都由k决定，抽到的一行不一致就说明读到了写了一半的经验
+    s = np.full(16, k % 200, dtype=np.uint8)
+    return s, k % 4, float(k), s, bool(k % 2)
+
+
+def _consistent(batch):
+    states, actions, rewards, states_next, dones = batch[:5]
+    k = rewards.astype(np.int64)
+    return (np.all(states.reshape((len(k), -1)) == (k % 200)[:, None]) and np.all(actions == k % 4) and
+            np.all(states_next.reshape((len(k), -1)) == (k % 200)[:, None]) and np.all(dones == (k % 2 == 1)))
+
+
+@pytest.mark.parametrize('buffer_class', [ReplayBuffer, PrioritizedReplayBuffer])
+def test_prefetched_batches_are_consistent_while_storing(buffer_class):
+    memory = buffer_class(64)
+    for k in range(64):
+        memory.store(*_row(k))
+    prefetcher = BatchPrefetcher(memory, batch_size=32, depth=2)
+    stop = threading.Event()
+
+    def writer():
+        k = 64
+        while not stop.is_set():
+            memory.store(*_row(k))
+            k += 1
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        for _ in range(300):
+            batch = prefetcher.get()
+            assert _consistent(batch)
+            if buffer_class is PrioritizedReplayBuffer:
+                memory.update_priorities(batch[5], np.ones(32), prefetcher.sampled_counter)
+    finally:
+        stop.set()
+        thread.join()
+        prefetcher.close()
+
+
+def test_update_priorities_skips_overwritten_slots():
+    memory = PrioritizedReplayBuffer(8, alpha=1.0)
+    for k in range(8):
+        memory.store(*_row(k))
+    since = memory.counter
+    memory.store(*_row(8))  # 覆盖了位置0
+    memory.update_priorities(np.array([0, 1]), np.array([5.0, 5.0]), since)
+    assert memory.tree.get(0) == pytest.approx(1.0)  # 新经验的最大优先级
+    assert memory.tree.get(1) == pytest.approx(5.0 + memory.eps)
+
+
+def test_overwritten_since():
+    memory = ReplayBuffer(8)
+    for k in range(10):
+        memory.store(*_row(k))
+    # counter从6到10写了位置6、7、0、1
+    assert memory.overwritten_since(np.arange(8), 6).tolist() == [True, True, False, False, False, False,
+                                                                  True, True]
+    assert memory.overwritten_since(np.arange(8), 0).all()
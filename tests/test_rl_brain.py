@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('tensorflow')
+RL_brain = pytest.importorskip('RL_brain')
+
+
+def test_learn_and_replace_target():
+    rng = np.random.RandomState(0)
+    dqn = RL_brain.DeepQNetwork(4, 16, memory_size=50, batch_size=8, e_greedy_increment=0.01)
+    for _ in range(20):
+        s = rng.randint(0, 8, size=16)
+        dqn.store_transition(s, rng.randint(4), rng.uniform(), rng.randint(0, 8, size=16))
+    dqn.learn()
+    dqn.learn()
+    assert len(dqn.cost_his) == 2 and np.all(np.isfinite(dqn.cost_his))
+    # 第一次learn前复制过一次，之后eval_net训练过，和target_net不同了
+    assert any(not np.allclose(e, t) for e, t in zip(dqn.eval_net.get_weights(), dqn.target_net.get_weights()))
+    dqn.replace_target_op()
+    for e, t in zip(dqn.eval_net.get_weights(), dqn.target_net.get_weights()):
+        np.testing.assert_array_equal(e, t)
+    assert 0 <= dqn.choose_action(rng.randint(0, 8, size=16)) < 4
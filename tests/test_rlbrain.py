@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('tensorflow')
+my_rlbrain = pytest.importorskip('my_rlbrain')
+
+
+def _batch(size, seed=0):
+    rng = np.random.RandomState(seed)
+    states = rng.randint(0, 8, size=(size, 4, 4, 1)).astype(np.float32)
+    states_next = rng.randint(0, 8, size=(size, 4, 4, 1)).astype(np.float32)
+    actions = rng.randint(4, size=size)
+    rewards = rng.uniform(-10, 100, size=size).astype(np.float32)
+    dones = rng.uniform(size=size) < 0.1
+    return states, actions, rewards, states_next, dones
+
+
+def _pair():
+    unfused = my_rlbrain.DqnCon(fused=False)
+    fused = my_rlbrain.DqnCon(fused=True)
+    fused.real.set_weights(unfused.real.get_weights())
+    fused.target.set_weights(unfused.target.get_weights())
+    return unfused, fused
+
+
+def _td_errors(brain, states, actions, rewards, states_next, dones):
+    # 和_learn_unfused里更新优先级用的TD误差相同
+    rows = np.arange(len(states))
+    q_eval = brain.real.predict(states)[rows, actions]
+    best = np.argmax(brain.real.predict(states_next), axis=1)
+    q_next = brain.target.predict(states_next)[rows, best]
+    return rewards + (1 - dones) * brain.gamma * q_next - q_eval
+
+
+@pytest.mark.parametrize('size', [32, 50])
+def test_fused_td_errors_match_unfused(size):
+    unfused, fused = _pair()
+    states, actions, rewards, states_next, dones = _batch(size)
+    expected = _td_errors(unfused, states, actions, rewards, states_next, dones)
+    td = fused.learn_step(states, states_next, actions.astype(np.int32), rewards, dones.astype(np.float32),
+                          np.ones(size, dtype=np.float32))
+    np.testing.assert_allclose(td.numpy(), expected, rtol=1e-4, atol=1e-4)
+
+
+def test_fused_update_matches_unfused():
+    # 32条时fit只有一个小批，打乱顺序不影响结果，两种做法更新后的权重应该相同
+    unfused, fused = _pair()
+    states, actions, rewards, states_next, dones = _batch(32, seed=1)
+    unfused._learn_unfused(states, actions, rewards, states_next, dones, None, None)
+    fused.learn_step(states, states_next, actions.astype(np.int32), rewards, dones.astype(np.float32),
+                     np.ones(32, dtype=np.float32))
+    for a, b in zip(unfused.real.get_weights(), fused.real.get_weights()):
+        np.testing.assert_allclose(a, b, rtol=1e-3, atol=1e-4)